@@ -0,0 +1,90 @@
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import billing, fx, models
+
+Sub = models.Subscription
+
+
+def _cycle_expr():
+    # NULL billing_cycle is what the column default means: monthly
+    return func.coalesce(Sub.billing_cycle, billing.DEFAULT_CYCLE)
+
+
+async def subscription_spend(db: AsyncSession, user_id: Optional[int] = None, top: int = 5,
+                             rates: Optional[fx.FxRates] = None, currency: Optional[str] = None) -> dict:
+    """Monthly/yearly spend per currency and per billing cycle, plus the top-N services.
+
+    All row-level work happens in SQL: one GROUP BY over (currency, billing_cycle)
+    and one windowed top-N query. Python only touches the handful of groups.
+    user_id=None aggregates across every user. With rates/currency the per-currency
+    totals are also summed into one converted figure (one rate lookup per currency).
+    """
+    owner_filter = [Sub.owner_id == user_id] if user_id is not None else []
+    cycle = _cycle_expr()
+
+    groups = (await db.execute(
+        select(Sub.currency, cycle.label('billing_cycle'), func.count().label('n'), func.sum(Sub.cost).label('total'))
+        .where(*owner_filter)
+        .group_by(Sub.currency, cycle)
+    )).all()
+
+    totals = defaultdict(lambda: {'monthly': 0.0, 'count': 0})
+    by_cycle, factors, unrecognized = [], {}, set()
+    for g in groups:
+        parsed = billing.parse_cycle(g.billing_cycle)
+        if parsed is None:
+            unrecognized.add(g.billing_cycle)
+            continue
+        factors[g.billing_cycle] = parsed.per_month
+        monthly = g.total * parsed.per_month
+        by_cycle.append({'billing_cycle': g.billing_cycle, 'currency': g.currency, 'count': g.n,
+                         'monthly': round(monthly, 2), 'yearly': round(monthly * 12, 2)})
+        t = totals[g.currency]
+        t['monthly'] += monthly
+        t['count'] += g.n
+
+    top_rows = []
+    if factors and top > 0:
+        # Per-row normalisation in SQL via a CASE over the cycles actually present
+        monthly_cost = (Sub.cost * case(factors, value=cycle)).label('monthly_cost')
+        rank = func.row_number().over(partition_by=Sub.currency, order_by=(monthly_cost.desc(), Sub.id)).label('rank')
+        ranked = (
+            select(Sub.id, Sub.owner_id, Sub.service_name, Sub.cost, Sub.currency, cycle.label('billing_cycle'),
+                   monthly_cost, rank)
+            .where(*owner_filter, cycle.in_(list(factors)))
+            .subquery()
+        )
+        top_rows = (await db.execute(
+            select(ranked).where(ranked.c.rank <= top).order_by(ranked.c.currency, ranked.c.rank)
+        )).all()
+
+    converted = None
+    if currency:
+        monthly, unconverted = 0.0, []
+        for cur, t in totals.items():
+            value = rates.convert(t['monthly'], cur, currency)
+            if value is None:
+                unconverted.append(cur)
+            else:
+                monthly += value
+        converted = {'currency': currency, 'monthly': round(monthly, 2), 'yearly': round(monthly * 12, 2),
+                     'unconverted_currencies': sorted(unconverted)}
+
+    return {
+        'totals': [
+            {'currency': cur, 'count': t['count'], 'monthly': round(t['monthly'], 2), 'yearly': round(t['monthly'] * 12, 2)}
+            for cur, t in sorted(totals.items())
+        ],
+        'by_cycle': sorted(by_cycle, key=lambda r: (r['currency'], r['billing_cycle'])),
+        'top': [
+            {'id': r.id, 'owner_id': r.owner_id, 'service_name': r.service_name, 'cost': r.cost,
+             'currency': r.currency, 'billing_cycle': r.billing_cycle, 'monthly_cost': round(r.monthly_cost, 2)}
+            for r in top_rows
+        ],
+        'unrecognized_cycles': sorted(unrecognized),
+        'converted': converted,
+    }
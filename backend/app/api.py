@@ -1,40 +1,150 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 import base64
-from datetime import timedelta
+import binascii
+import json
+import os
+from datetime import date, datetime, timedelta
 
-from . import crud, models, schemas, auth, crypto
-from .config import ACCESS_TOKEN_EXPIRE_MINUTES
+from . import analytics, crud, fx, models, schemas, auth, crypto, importer, kdf, metrics, ratelimit, rollover, serialization
+from .config import (
+    ACCESS_TOKEN_EXPIRE_MINUTES, KDF_ALGORITHM, KDF_ITERS, SALT_SIZE, PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, CARD_BATCH_MAX,
+    SEARCH_LIMIT_DEFAULT, SEARCH_LIMIT_MAX, UPCOMING_DAYS_DEFAULT, UPCOMING_DAYS_MAX, FORECAST_MONTHS_DEFAULT, FORECAST_MONTHS_MAX,
+)
+from .db import SessionLocal, get_pool_stats
 
 # Cоздаем роутер. Все эндпоинты будут привязаны к нему.
 router = APIRouter()
 
+# --- Pagination ---
+# The next-page cursor goes out in a header so list bodies stay plain JSON arrays
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        return crud.decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+
+# --- Conditional GET ---
+# ETags come from the per-user data_version, so a 304 costs one indexed scalar
+# lookup and no row loading or serialization.
+
+async def _data_etag(db: AsyncSession, user_id: int, variant: str = '') -> str:
+    # variant distinguishes representations of the same data (e.g. msgpack vs JSON)
+    version = await crud.get_data_version(db, user_id)
+    return f'"{user_id}-{version}-{variant}"' if variant else f'"{user_id}-{version}"'
+
+def _not_modified(request: Request, response: Response, etag: str, wildcard: bool = True) -> Optional[Response]:
+    # If-None-Match: * means "any current representation", so detail endpoints
+    # pass wildcard=False until they know the row exists
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache', 'Vary': 'Accept'}
+    inm = request.headers.get('if-none-match')
+    if inm:
+        tags = [t.strip() for t in inm.split(',')]
+        if (wildcard and '*' in tags) or etag in tags or f'W/{etag}' in tags:
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# --- Currency conversion ---
+
+def _fx_target(currency: Optional[str]):
+    if currency is None:
+        return None, None
+    rates = fx.cache.get()
+    try:
+        return rates, rates.check(currency)
+    except fx.UnknownCurrency as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _fx_variant(rates, target: Optional[str]) -> str:
+    # A reloaded rate table changes converted bodies without touching data_version
+    return f'fx-{target}-{rates.version}' if target else ''
+
 # --- Auth Endpoints ---
 
+def _client_ip(request: Request) -> Optional[str]:
+    return request.client.host if request.client else None
+
 @router.post("/register", response_model=schemas.Token)
-def register(u: schemas.UserCreate, db: Session = Depends(auth.get_db)):
-    if crud.get_user_by_username(db, u.username):
+async def register(u: schemas.UserCreate, request: Request, db: AsyncSession = Depends(auth.get_db)):
+    # Registration costs a KDF run too; metered on the client's bucket only
+    await ratelimit.limiter.check(_client_ip(request))
+    if await crud.get_user_by_username(db, u.username):
         raise HTTPException(status_code=400, detail="Username exists")
     
-    user = crud.create_user(db, u)
+    # PBKDF2 runs in the dedicated KDF pool, not in the request threadpool
+    salt = os.urandom(SALT_SIZE)
+    verifier = await kdf.make_password_verifier(u.password, salt, KDF_ITERS, KDF_ALGORITHM)
+    try:
+        user = await crud.create_user(db, u, salt, verifier, KDF_ALGORITHM, KDF_ITERS)
+    except IntegrityError:
+        # Lost a race with a concurrent /register for the same name
+        raise HTTPException(status_code=400, detail="Username exists")
     token = auth.create_access_token(
         {"sub": user.username}, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     return {"access_token": token, "token_type": "bearer"}
 
+async def _rehash_password(db: AsyncSession, user: models.User, password: str):
+    # The plaintext is only available right after a successful login, so
+    # that is where verifiers move to the current KDF parameters
+    salt = os.urandom(SALT_SIZE)
+    try:
+        verifier = await kdf.make_password_verifier(password, salt, KDF_ITERS, KDF_ALGORITHM)
+    except kdf.KdfBusy:
+        # Never fail a good login over this; the next one retries
+        metrics.kdf_rehash.inc('skipped')
+        return
+    if await crud.update_user_verifier(db, user.id, user.password_verifier, salt, verifier,
+                                       KDF_ALGORITHM, KDF_ITERS):
+        # Core UPDATE: the ORM after_update hook doesn't run for it
+        auth.user_cache.invalidate(user.username)
+        metrics.kdf_rehash.inc('ok')
+
 @router.post('/token', response_model=schemas.Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(auth.get_db)):
-    user = crud.get_user_by_username(db, form_data.username)
-    if not user or not crypto.verify_password(form_data.password, user.password_salt, user.password_verifier):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(),
+                db: AsyncSession = Depends(auth.get_db)):
+    # Throttled before the user lookup and the KDF, so a rejected attempt is nearly free
+    await ratelimit.limiter.check(_client_ip(request), form_data.username)
+    user = await crud.get_user_by_username(db, form_data.username)
+    if not user:
         raise HTTPException(status_code=401, detail="Incorrect credentials")
-    
+    algorithm, iterations = crypto.user_kdf_params(user)
+    if not await kdf.verify_password(form_data.password, user.password_salt, user.password_verifier,
+                                     iterations, algorithm):
+        raise HTTPException(status_code=401, detail="Incorrect credentials")
+    if crypto.needs_rehash(user):
+        await _rehash_password(db, user, form_data.password)
+
     token = auth.create_access_token(
         {"sub": user.username}, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     )
     return {"access_token": token, "token_type": "bearer"}
 
+@router.post('/logout')
+async def logout(all: bool = False,
+                 token: str = Depends(auth.oauth2_scheme),
+                 current_user: models.User = Depends(auth.get_current_user),
+                 db: AsyncSession = Depends(auth.get_db)):
+    """Revoke the presented token, or with ?all=true every token issued to the user so far.
+
+    Takes effect at once on the worker that handles the call and within
+    AUTH_REVOCATION_CHECK seconds (default 1) on every other worker.
+    """
+    if all:
+        await auth.revoke_user_tokens(db, current_user.username)
+    else:
+        await auth.revoke_token(db, token, current_user)
+    return {"detail": "logged out"}
+
 # --- Card Endpoints ---
 
 # @router.post('/cards', response_model=schemas.CardOut)
@@ -94,50 +204,168 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
 #         cvv=payload.get('cvv'), notes=payload.get('notes'), created_at=c.created_at
 #     )
 
+# --- Binary transport ---
+# Card endpoints speak JSON/base64 by default and msgpack with raw bytes when the
+# client sends Content-Type / Accept: application/msgpack.
+
+def _card_body_openapi(schema: dict) -> dict:
+    return {'requestBody': {'required': True, 'content': {
+        'application/json': {'schema': schema},
+        serialization.MSGPACK: {'schema': schema},
+    }}}
+
+async def _parse_card_body(request: Request, many: bool, partial: bool = False):
+    body = await request.body()
+    binary = serialization.is_msgpack(request.headers.get('content-type'))
+    model = schemas.RawCardBinIn if binary else schemas.RawCardIn
+    try:
+        data = serialization.unpackb(body) if binary else json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Malformed request body')
+    if not many:
+        return _parse_card(model, data, ('body',))
+    if not isinstance(data, list):
+        raise RequestValidationError([{'loc': ('body',), 'msg': 'Expected a list of cards', 'type': 'list_type'}])
+    if not partial:
+        return [(i, _parse_card(model, item, ('body', i))) for i, item in enumerate(data)], []
+    # ?partial=true: a malformed item is reported by index and the rest still go in
+    cards, errors = [], []
+    for i, item in enumerate(data):
+        try:
+            cards.append((i, model.parse_obj(item)))
+        except ValidationError as e:
+            errors.append((i, '; '.join(f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}"
+                                        for err in e.errors())))
+    return cards, errors
+
+def _parse_card(model, data, loc: tuple):
+    # Same 422 shape FastAPI produces for declared body parameters
+    try:
+        return model.parse_obj(data)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, 'loc': loc + tuple(err['loc'])} for err in e.errors()])
+
+async def raw_card_body(request: Request):
+    return await _parse_card_body(request, many=False)
+
+async def raw_cards_body(request: Request, partial: bool = False):
+    return await _parse_card_body(request, many=True, partial=partial)
+
+def _card_json(id, label, created_at, enc_data: bytes, nonce: bytes, raw=None) -> schemas.RawCardOut:
+    # Echo the client's base64 when it sent JSON instead of re-encoding the bytes
+    if isinstance(raw, schemas.RawCardIn):
+        enc_b64, nonce_b64 = raw.enc_data_b64, raw.nonce_b64
+    else:
+        enc_b64, nonce_b64 = base64.b64encode(enc_data).decode('ascii'), base64.b64encode(nonce).decode('ascii')
+    return schemas.RawCardOut(id=id, label=label, enc_data_b64=enc_b64, nonce_b64=nonce_b64, created_at=created_at)
+
 # --- Card Endpoints (Используем RAW-логику как основную) ---
 
 # Было: @router.post('/cards', response_model=schemas.CardOut)
-@router.post('/cards', response_model=schemas.RawCardOut)
-def create_card(card: schemas.RawCardIn, # <-- Схема изменена на RawCardIn
+@router.post('/cards', response_model=schemas.RawCardOut,
+             openapi_extra=_card_body_openapi(schemas.RawCardIn.schema()))
+async def create_card(request: Request,
+                card = Depends(raw_card_body), # RawCardIn (JSON) или RawCardBinIn (msgpack)
                 current_user: models.User = Depends(auth.get_current_user), 
-                db: Session = Depends(auth.get_db)):
+                db: AsyncSession = Depends(auth.get_db)):
     
-    db_card = crud.create_user_card(db, card, current_user.id) # <-- Вызываем переименованный crud
+    try:
+        db_card = await crud.create_user_card(db, card, current_user.id) # <-- Вызываем переименованный crud
+    except binascii.Error as e:
+        raise HTTPException(status_code=422, detail=f'Invalid base64: {e}')
     
+    if serialization.wants_msgpack(request):
+        return serialization.msgpack_response(serialization.card_record(
+            db_card.id, db_card.label, db_card.enc_data, db_card.nonce, db_card.created_at
+        ))
     # Теперь возвращаем RawCardOut
-    return schemas.RawCardOut(
-        id=db_card.id, label=db_card.label, 
-        enc_data_b64=card.enc_data_b64, # Возвращаем то, что прислал клиент
-        nonce_b64=card.nonce_b64, 
-        created_at=db_card.created_at
+    return _card_json(db_card.id, db_card.label, db_card.created_at, db_card.enc_data, db_card.nonce, raw=card)
+
+@router.post('/cards/batch', response_model=schemas.RawCardBatchOut,
+             openapi_extra=_card_body_openapi({'type': 'array', 'items': schemas.RawCardIn.schema()}))
+async def create_cards_batch(request: Request,
+                             partial: bool = False,
+                             parsed = Depends(raw_cards_body),
+                             current_user: models.User = Depends(auth.get_current_user),
+                             db: AsyncSession = Depends(auth.get_db)):
+    
+    cards, invalid = parsed
+    if len(cards) + len(invalid) > CARD_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f'At most {CARD_BATCH_MAX} cards per batch')
+    created, errors = await crud.create_user_cards(db, cards, current_user.id, partial=partial)
+    raws = dict(cards)
+    errors = [schemas.RawCardBatchError(index=i, detail=msg) for i, msg in sorted(invalid + errors)]
+    if errors and not partial:
+        raise HTTPException(status_code=422, detail=[e.dict() for e in errors])
+    
+    if serialization.wants_msgpack(request):
+        return serialization.msgpack_response({
+            'created': [
+                serialization.card_record(row.id, row.label, enc_data, nonce, row.created_at)
+                for i, row, enc_data, nonce in created
+            ],
+            'errors': [e.dict() for e in errors],
+        })
+    return schemas.RawCardBatchOut(
+        created=[
+            _card_json(row.id, row.label, row.created_at, enc_data, nonce, raw=raws[i])
+            for i, row, enc_data, nonce in created
+        ],
+        errors=errors
     )
 
 # Было: @router.get('/cards', response_model=List[schemas.CardOut])
 @router.get('/cards', response_model=List[schemas.RawCardOut])
-def list_cards(current_user: models.User = Depends(auth.get_current_user), 
-               db: Session = Depends(auth.get_db)):
+async def list_cards(request: Request, response: Response,
+               limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+               cursor: Optional[str] = None,
+               current_user: models.User = Depends(auth.get_current_user), 
+               db: AsyncSession = Depends(auth.get_db)):
     
-    cards = crud.get_user_cards(db, current_user.id)
+    binary = serialization.wants_msgpack(request)
+    etag = await _data_etag(db, current_user.id, 'msgpack' if binary else '')
+    if (not_modified := _not_modified(request, response, etag)):
+        return not_modified
+    after_id = None
+    if cursor:
+        key = _decode_cursor(cursor)
+        if len(key) != 1 or not isinstance(key[0], int):
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+        after_id = key[0]
+    # One extra row tells us whether there is a next page
+    cards = await crud.get_user_cards(db, current_user.id, limit=limit + 1, after_id=after_id)
+    if len(cards) > limit:
+        cards = cards[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = crud.encode_cursor(cards[-1].id)
+    if binary:
+        return serialization.msgpack_response(
+            [serialization.card_record(c.id, c.label, c.enc_data, c.nonce, c.created_at) for c in cards],
+            headers=dict(response.headers)
+        )
     # Удалена логика дешифровки, просто возвращаем RAW
-    return [
-        schemas.RawCardOut(
-            id=c.id, label=c.label, 
-            enc_data_b64=base64.b64encode(c.enc_data).decode('ascii'), 
-            nonce_b64=base64.b64encode(c.nonce).decode('ascii'), 
-            created_at=c.created_at
-        ) for c in cards
-    ]
+    return serialization.json_response([serialization.card_json(c) for c in cards], headers=dict(response.headers))
 
 # Было: @router.get('/cards/{card_id}', response_model=schemas.CardFull)
 @router.get('/cards/{card_id}', response_model=schemas.RawCardOut)
-def get_card(card_id: int, 
+async def get_card(card_id: int, request: Request, response: Response,
              current_user: models.User = Depends(auth.get_current_user), 
-             db: Session = Depends(auth.get_db)):
+             db: AsyncSession = Depends(auth.get_db)):
     
-    c = crud.get_user_card(db, card_id, current_user.id)
+    binary = serialization.wants_msgpack(request)
+    etag = await _data_etag(db, current_user.id, 'msgpack' if binary else '')
+    if (not_modified := _not_modified(request, response, etag, wildcard=False)):
+        return not_modified
+    c = await crud.get_user_card(db, card_id, current_user.id)
     if not c:
         raise HTTPException(status_code=404, detail='Not found')
+    if (not_modified := _not_modified(request, response, etag)):
+        return not_modified
     
+    if binary:
+        return serialization.msgpack_response(
+            serialization.card_record(c.id, c.label, c.enc_data, c.nonce, c.created_at),
+            headers=dict(response.headers)
+        )
     # Удалена логика дешифровки, возвращаем RAW
     return schemas.RawCardOut(
         id=c.id, label=c.label, 
@@ -150,11 +378,11 @@ def get_card(card_id: int,
 # Убедитесь, что роуты /cards/raw/... БОЛЬШЕ не существуют!
 
 @router.delete('/cards/{card_id}')
-def delete_card(card_id: int, 
+async def delete_card(card_id: int, 
                 current_user: models.User = Depends(auth.get_current_user), 
-                db: Session = Depends(auth.get_db)):
+                db: AsyncSession = Depends(auth.get_db)):
     
-    deleted = crud.delete_user_card(db, card_id, current_user.id)
+    deleted = await crud.delete_user_card(db, card_id, current_user.id)
     if not deleted:
         raise HTTPException(status_code=404, detail='Not found')
     return {"detail": "deleted"}
@@ -205,45 +433,286 @@ def delete_card(card_id: int,
 # --- Subscription Endpoints ---
 
 @router.post('/subscriptions', response_model=schemas.SubscriptionOut)
-def create_subscription(sub: schemas.SubscriptionCreate, 
+async def create_subscription(sub: schemas.SubscriptionCreate, 
                         current_user: models.User = Depends(auth.get_current_user), 
-                        db: Session = Depends(auth.get_db)):
+                        db: AsyncSession = Depends(auth.get_db)):
+    
+    return await crud.create_user_sub(db, sub, current_user.id)
+
+@router.post('/subscriptions/import', response_model=schemas.SubscriptionImportOut)
+async def import_subscriptions(file: UploadFile = File(...),
+                               format: Optional[str] = Query(None, pattern='^(csv|ndjson)$'),
+                               current_user: models.User = Depends(auth.get_current_user), 
+                               db: AsyncSession = Depends(auth.get_db)):
+    
+    if format is None:
+        try:
+            format = importer.detect_format(file.filename, file.content_type)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return await importer.import_subscriptions(db, file.file, format, current_user.id)
+
+@router.get('/subscriptions', response_model=List[schemas.SubscriptionListOut])
+async def list_subscriptions(request: Request, response: Response,
+                       limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+                       cursor: Optional[str] = None,
+                       currency: Optional[str] = None,
+                       current_user: models.User = Depends(auth.get_current_user), 
+                       db: AsyncSession = Depends(auth.get_db)):
+    
+    rates, target = _fx_target(currency)
+    etag = await _data_etag(db, current_user.id, _fx_variant(rates, target))
+    if (not_modified := _not_modified(request, response, etag)):
+        return not_modified
+    after = None
+    if cursor:
+        key = _decode_cursor(cursor)
+        try:
+            after_date, after_id = key
+            after = (date.fromisoformat(after_date) if after_date is not None else None, int(after_id))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+    subs = await crud.get_user_subs(db, current_user.id, limit=limit + 1, after=after)
+    if len(subs) > limit:
+        subs = subs[:limit]
+        last = subs[-1]
+        response.headers[NEXT_CURSOR_HEADER] = crud.encode_cursor(last.next_billing_date, last.id)
+    body = [serialization.sub_json(s) for s in subs]
+    if target:
+        for s in body:
+            converted = rates.convert(s['cost'], s['currency'], target)
+            s['converted_cost'] = round(converted, 2) if converted is not None else None
+            s['converted_currency'] = target
+    return serialization.json_response(body, headers=dict(response.headers))
+
+def _upcoming_after(cursor: Optional[str], size: int):
+    if not cursor:
+        return None
+    key = _decode_cursor(cursor)
+    try:
+        if len(key) != size:
+            raise ValueError
+        return (date.fromisoformat(key[0]), *(int(k) for k in key[1:]))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+
+def _upcoming_window(days: int):
+    today = date.today()
+    return today, today + timedelta(days=days)
+
+@router.get('/subscriptions/upcoming', response_model=List[schemas.UpcomingBillingOut])
+async def upcoming_subscriptions(request: Request, response: Response,
+                           days: int = Query(UPCOMING_DAYS_DEFAULT, ge=0, le=UPCOMING_DAYS_MAX),
+                           limit: int = Query(PAGE_SIZE_DEFAULT, ge=1, le=PAGE_SIZE_MAX),
+                           cursor: Optional[str] = None,
+                           current_user: models.User = Depends(auth.get_current_user), 
+                           db: AsyncSession = Depends(auth.get_db)):
     
-    return crud.create_user_sub(db, sub, current_user.id)
+    start, end = _upcoming_window(days)
+    # The window moves with the calendar, so the date is part of the validator
+    etag = await _data_etag(db, current_user.id, f'upcoming-{start.isoformat()}-{days}')
+    if (not_modified := _not_modified(request, response, etag)):
+        return not_modified
+    after = _upcoming_after(cursor, 2)
+    subs = await crud.get_upcoming_subs(db, start, end, current_user.id, limit=limit + 1, after=after)
+    if len(subs) > limit:
+        subs = subs[:limit]
+        last = subs[-1]
+        response.headers[NEXT_CURSOR_HEADER] = crud.encode_cursor(last.next_billing_date, last.id)
+    return serialization.json_response([serialization.sub_json(s) for s in subs], headers=dict(response.headers))
 
-@router.get('/subscriptions', response_model=List[schemas.SubscriptionOut])
-def list_subscriptions(current_user: models.User = Depends(auth.get_current_user), 
-                       db: Session = Depends(auth.get_db)):
+@router.get('/subscriptions/forecast', response_model=schemas.ForecastOut)
+async def subscription_forecast(request: Request, response: Response,
+                                months: int = Query(FORECAST_MONTHS_DEFAULT, ge=1, le=FORECAST_MONTHS_MAX),
+                                charges: bool = True,
+                                currency: Optional[str] = None,
+                                current_user: models.User = Depends(auth.get_current_user), 
+                                db: AsyncSession = Depends(auth.get_db)):
     
-    return crud.get_user_subs(db, current_user.id)
+    rates, target = _fx_target(currency)
+    today = date.today().isoformat()
+    variant = '-'.join(filter(None, (f'forecast-{today}-{months}-{int(charges)}', _fx_variant(rates, target))))
+    etag = await _data_etag(db, current_user.id, variant)
+    if (not_modified := _not_modified(request, response, etag)):
+        return not_modified
+    # Imported on first use: NumPy is the largest single import and only this endpoint needs it
+    from . import forecast
+    result = await forecast.subscription_forecast(db, current_user.id, months, charges=charges, rates=rates, currency=target)
+    return serialization.json_response(result, headers=dict(response.headers))
+
+@router.get('/subscriptions/analytics', response_model=schemas.SpendAnalyticsOut)
+async def subscription_analytics(top: int = Query(5, ge=0, le=100),
+                                 currency: Optional[str] = None,
+                                 current_user: models.User = Depends(auth.get_current_user), 
+                                 db: AsyncSession = Depends(auth.get_db)):
+    rates, target = _fx_target(currency)
+    return await analytics.subscription_spend(db, current_user.id, top=top, rates=rates, currency=target)
 
 @router.get('/subscriptions/{sub_id}', response_model=schemas.SubscriptionOut)
-def get_subscription(sub_id: int, 
+async def get_subscription(sub_id: int, request: Request, response: Response,
                      current_user: models.User = Depends(auth.get_current_user), 
-                     db: Session = Depends(auth.get_db)):
+                     db: AsyncSession = Depends(auth.get_db)):
     
-    sub = crud.get_user_sub(db, sub_id, current_user.id)
+    etag = await _data_etag(db, current_user.id)
+    if (not_modified := _not_modified(request, response, etag, wildcard=False)):
+        return not_modified
+    sub = await crud.get_user_sub(db, sub_id, current_user.id)
     if not sub:
         raise HTTPException(status_code=404, detail='Subscription not found')
+    if (not_modified := _not_modified(request, response, etag)):
+        return not_modified
     return sub
 
 @router.put('/subscriptions/{sub_id}', response_model=schemas.SubscriptionOut)
-def update_subscription(sub_id: int, 
+async def update_subscription(sub_id: int, 
                         sub_in: schemas.SubscriptionCreate, 
                         current_user: models.User = Depends(auth.get_current_user), 
-                        db: Session = Depends(auth.get_db)):
+                        db: AsyncSession = Depends(auth.get_db)):
     
-    sub_db = crud.update_user_sub(db, sub_id, sub_in, current_user.id)
+    sub_db = await crud.update_user_sub(db, sub_id, sub_in, current_user.id)
     if not sub_db:
         raise HTTPException(status_code=404, detail='Subscription not found')
     return sub_db
 
 @router.delete('/subscriptions/{sub_id}')
-def delete_subscription(sub_id: int, 
+async def delete_subscription(sub_id: int, 
                         current_user: models.User = Depends(auth.get_current_user), 
-                        db: Session = Depends(auth.get_db)):
+                        db: AsyncSession = Depends(auth.get_db)):
     
-    sub_db = crud.delete_user_sub(db, sub_id, current_user.id)
+    sub_db = await crud.delete_user_sub(db, sub_id, current_user.id)
     if not sub_db:
         raise HTTPException(status_code=404, detail='Subscription not found')
-    return {"detail": "deleted"}
\ No newline at end of file
+    return {"detail": "deleted"}
+
+# --- Search ---
+
+@router.get('/search', response_model=schemas.SearchOut)
+async def search(q: str = Query(..., min_length=1, max_length=100),
+                 mode: str = Query('substring', pattern='^(prefix|substring)$'),
+                 kind: str = Query('all', pattern='^(all|subscriptions|cards)$'),
+                 limit: int = Query(SEARCH_LIMIT_DEFAULT, ge=1, le=SEARCH_LIMIT_MAX),
+                 current_user: models.User = Depends(auth.get_current_user), 
+                 db: AsyncSession = Depends(auth.get_db)):
+    
+    # Matches subscription service names and card labels, case-insensitively
+    subs = cards = []
+    if kind in ('all', 'subscriptions'):
+        subs = await crud.search_user_subs(db, current_user.id, q, mode, limit)
+    if kind in ('all', 'cards'):
+        cards = await crud.search_user_cards(db, current_user.id, q, mode, limit)
+    return serialization.json_response({
+        'subscriptions': [serialization.sub_json(s) for s in subs],
+        'cards': [serialization.card_json(c) for c in cards],
+    })
+
+# --- Export ---
+
+NDJSON = 'application/x-ndjson'
+EXPORT_BUFFER_BYTES = 64 * 1024
+
+def _json_default(o):
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+    raise TypeError(f'{type(o).__name__} is not JSON serializable')
+
+async def _export_ndjson(user_id: Optional[int]):
+    # Owns its session: a Depends(get_db) session may be closed before the body is streamed
+    async with SessionLocal() as db:
+        buf, size = [], 0
+        async for record in crud.iter_vault(db, user_id):
+            line = json.dumps(record, default=_json_default, ensure_ascii=False, separators=(',', ':')) + '\n'
+            buf.append(line)
+            size += len(line)
+            if size >= EXPORT_BUFFER_BYTES:
+                yield ''.join(buf)
+                buf, size = [], 0
+        if buf:
+            yield ''.join(buf)
+
+def _export_response(user_id: Optional[int], filename: str):
+    return StreamingResponse(
+        _export_ndjson(user_id), media_type=NDJSON,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@router.get('/export')
+async def export_vault(current_user: models.User = Depends(auth.get_current_user)):
+    return _export_response(current_user.id, 'vault.ndjson')
+
+# --- Internal Endpoints ---
+
+internal = APIRouter(prefix='/internal', dependencies=[Depends(auth.require_internal_key)])
+
+@internal.get('/auth-cache')
+async def auth_cache_stats():
+    return auth.user_cache.stats()
+
+@internal.get('/token-cache')
+async def token_cache_stats():
+    return {**auth.token_cache.stats(), "revocations": auth.revocations.stats()}
+
+@internal.post('/users/{username}/revoke-tokens')
+async def revoke_user_tokens(username: str, db: AsyncSession = Depends(auth.get_db)):
+    """Revoke every token issued to the user so far (same propagation as /logout)."""
+    if not await auth.revoke_user_tokens(db, username):
+        raise HTTPException(status_code=404, detail='Not found')
+    return {"detail": "revoked"}
+
+@internal.get('/kdf-pool')
+async def kdf_pool_stats():
+    return kdf.pool.stats()
+
+@internal.get('/login-limits')
+async def login_limit_stats():
+    return ratelimit.limiter.stats()
+
+@internal.get('/db-pool')
+async def db_pool_stats():
+    return get_pool_stats()
+
+@internal.get('/jobs/rollover')
+async def rollover_stats():
+    return rollover.job.stats()
+
+@internal.post('/jobs/rollover')
+async def rollover_run():
+    # Run a pass now instead of waiting for the next interval
+    return await rollover.job.run_once()
+
+@internal.get('/subscriptions/upcoming', response_model=List[schemas.UpcomingBillingAllOut])
+async def upcoming_subscriptions_all(response: Response,
+                                     days: int = Query(UPCOMING_DAYS_DEFAULT, ge=0, le=UPCOMING_DAYS_MAX),
+                                     limit: int = Query(PAGE_SIZE_MAX, ge=1, le=PAGE_SIZE_MAX),
+                                     cursor: Optional[str] = None,
+                                     db: AsyncSession = Depends(auth.get_db)):
+    # Reminder fan-out: every user's billings in the window, paged by X-Next-Cursor
+    start, end = _upcoming_window(days)
+    after = _upcoming_after(cursor, 3)
+    subs = await crud.get_upcoming_subs(db, start, end, limit=limit + 1, after=after)
+    if len(subs) > limit:
+        subs = subs[:limit]
+        last = subs[-1]
+        response.headers[NEXT_CURSOR_HEADER] = crud.encode_cursor(last.next_billing_date, last.owner_id, last.id)
+    return serialization.json_response([serialization.sub_json(s) for s in subs], headers=dict(response.headers))
+
+@internal.get('/analytics/subscriptions', response_model=schemas.SpendAnalyticsOut)
+async def subscription_analytics_all(top: int = Query(10, ge=0, le=1000), currency: Optional[str] = None,
+                                     db: AsyncSession = Depends(auth.get_db)):
+    rates, target = _fx_target(currency)
+    return await analytics.subscription_spend(db, None, top=top, rates=rates, currency=target)
+
+@internal.get('/fx')
+async def fx_stats():
+    return fx.cache.stats()
+
+@internal.post('/fx/reload')
+async def fx_reload():
+    fx.cache.reload()
+    return fx.cache.stats()
+
+@internal.get('/export')
+async def export_all():
+    # Backup of every user's vault (cards still encrypted)
+    return _export_response(None, 'vault-backup.ndjson')
+
+router.include_router(internal)
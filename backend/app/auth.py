@@ -1,23 +1,29 @@
-from datetime import datetime, timedelta
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 import jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from . import crud, models, schemas, crypto
-from .config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from . import crud, models, schemas, crypto, metrics
+from .config import (
+    SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, INTERNAL_API_KEY,
+    USER_CACHE_SIZE, USER_CACHE_TTL, JWT_CACHE_SIZE, JWT_CACHE_TTL, AUTH_REVOCATION_CHECK,
+)
 from .db import SessionLocal
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
 # --- Dependency ---
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 # --- JWT ---
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -26,25 +32,186 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # Fractional iat, so revoking "everything issued so far" spares a token issued right after
+    to_encode.update({"exp": expire, "iat": time.time()})
+    with metrics.jwt_duration.time("encode"):
+        return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+# --- Auth caches ---
+class ExpiringCache:
+    """Bounded LRU whose entries live for at most `ttl` seconds and never past
+    the `exp` of the token that produced them.
+
+    Used for username -> detached User and for sha256(token) -> verified claims.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                hit = False
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                hit = True
+        metrics.auth_cache_lookups.inc(self.name, "hit" if hit else "miss")
+        return entry[1] if hit else None
+
+    def put(self, key, value, exp: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+user_cache = ExpiringCache("user", USER_CACHE_SIZE, USER_CACHE_TTL)
+token_cache = ExpiringCache("jwt", JWT_CACHE_SIZE, JWT_CACHE_TTL)
+_REVOKED = object()  # cached verdict for a token found in revoked_tokens
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _drop_cached_user(mapper, connection, target):
+    user_cache.invalidate(target.username)
+
+# --- Revocation ---
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+def _revoked_by_user(payload: dict, user: models.User) -> bool:
+    if user.tokens_revoked_at is None:
+        return False
+    cutoff = user.tokens_revoked_at.replace(tzinfo=timezone.utc).timestamp()
+    # Tokens from before iat was issued count as older than any revocation
+    return payload.get("iat", 0) < cutoff
+
+class RevocationSync:
+    """Keeps this worker's caches in line with revocations made by any worker.
+
+    Every revocation bumps auth_state.revocation_version in its transaction.
+    At most every `interval` seconds a request reads it (one primary-key
+    lookup); on a change both auth caches are dropped, so a revoked token or
+    user is re-checked against the database on its next request.
+    """
+
+    def __init__(self, interval: float = AUTH_REVOCATION_CHECK):
+        self.interval = interval
+        self.version: Optional[int] = None
+        self._next_check = 0.0
+        self.checks = 0
+        self.flushes = 0
+
+    async def sync(self, db: AsyncSession):
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        # Claimed before the await so concurrent requests don't all query
+        self._next_check = now + self.interval
+        version = await crud.get_revocation_version(db)
+        self.checks += 1
+        if self.version is not None and version != self.version:
+            token_cache.invalidate()
+            user_cache.invalidate()
+            self.flushes += 1
+        self.version = version
+
+    def stats(self) -> dict:
+        return {"interval": self.interval, "version": self.version, "checks": self.checks, "flushes": self.flushes}
+
+revocations = RevocationSync()
+
+async def revoke_token(db: AsyncSession, token: str, user: models.User):
+    digest = token_digest(token)
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    await crud.revoke_token(db, digest, user.id, datetime.utcfromtimestamp(payload["exp"]))
+    token_cache.put(digest, _REVOKED, payload["exp"])
+
+async def revoke_user_tokens(db: AsyncSession, username: str) -> bool:
+    user_id = await crud.revoke_user_tokens(db, username, datetime.utcnow())
+    # Core UPDATE: the after_update hook below doesn't fire for it
+    user_cache.invalidate(username)
+    return user_id is not None
 
 # --- Current User Dependency ---
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid token",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    await revocations.sync(db)
+    # Hot clients resend the same long-lived token: skip HMAC verification
+    # (and the revocation lookup) while its verified claims are cached
+    digest = token_digest(token)
+    payload = token_cache.get(digest)
+    if payload is _REVOKED:
+        raise credentials_exception
+    if payload is None:
+        try:
+            with metrics.jwt_duration.time("decode"):
+                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except jwt.PyJWTError:
+            raise credentials_exception
+        if await crud.is_token_revoked(db, digest):
+            token_cache.put(digest, _REVOKED, payload.get("exp"))
             raise credentials_exception
-    except jwt.PyJWTError:
+        token_cache.put(digest, payload, payload.get("exp"))
+    username: str = payload.get("sub")
+    if username is None:
         raise credentials_exception
-    
-    user = crud.get_user_by_username(db, username=username)
+
+    user = user_cache.get(username)
     if user is None:
+        user = await crud.get_user_by_username(db, username=username)
+        if user is None:
+            raise credentials_exception
+        # Detach so commits in this (or any later) session can't expire the shared instance
+        db.expunge(user)
+        user_cache.put(username, user, payload.get("exp"))
+    if _revoked_by_user(payload, user):
         raise credentials_exception
-    return user
\ No newline at end of file
+    return user
+
+# --- Internal endpoints guard ---
+def require_internal_key(x_internal_key: Optional[str] = Header(None)):
+    if not INTERNAL_API_KEY or not x_internal_key or not secrets.compare_digest(x_internal_key, INTERNAL_API_KEY):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Forbidden")
@@ -0,0 +1,92 @@
+import calendar
+import re
+from dataclasses import dataclass
+from datetime import date, timedelta
+from functools import lru_cache
+from typing import Optional
+
+# Subscription.billing_cycle is free text; this is the one place that gives it meaning.
+AVG_DAYS_PER_MONTH = 365.25 / 12
+DEFAULT_CYCLE = 'monthly'
+
+
+@dataclass(frozen=True)
+class Cycle:
+    """A billing step of either whole months or whole days (exactly one is non-zero)."""
+    months: int = 0
+    days: int = 0
+
+    @property
+    def per_month(self) -> float:
+        # How many charges fall in an average month
+        if self.months:
+            return 1 / self.months
+        return AVG_DAYS_PER_MONTH / self.days
+
+
+NAMED_CYCLES = {
+    'daily': Cycle(days=1),
+    'weekly': Cycle(days=7),
+    'biweekly': Cycle(days=14),
+    'fortnightly': Cycle(days=14),
+    'monthly': Cycle(months=1),
+    'bimonthly': Cycle(months=2),
+    'quarterly': Cycle(months=3),
+    'semiannual': Cycle(months=6),
+    'semiannually': Cycle(months=6),
+    'half-yearly': Cycle(months=6),
+    'yearly': Cycle(months=12),
+    'annual': Cycle(months=12),
+    'annually': Cycle(months=12),
+}
+
+_UNITS = {'d': (0, 1), 'w': (0, 7), 'm': (1, 0), 'y': (12, 0)}
+# "30 days", "every 2 weeks", "3m", "1 year", ...; longer digit runs are never a real cycle
+_CUSTOM = re.compile(r'^(?:every\s+)?(\d{1,9})\s*(d|days?|w|weeks?|m|mo|months?|y|years?)$')
+# Longest accepted step: anything beyond ~100 years would only overflow date arithmetic
+MAX_CYCLE_MONTHS = 100 * 12
+MAX_CYCLE_DAYS = 36_600
+
+
+@lru_cache(maxsize=1024)
+def parse_cycle(text: Optional[str]) -> Optional[Cycle]:
+    """Return the Cycle for a billing_cycle value, or None if it is not understood."""
+    key = (text or DEFAULT_CYCLE).strip().lower()
+    if key in NAMED_CYCLES:
+        return NAMED_CYCLES[key]
+    m = _CUSTOM.match(key)
+    if not m:
+        return None
+    n = int(m.group(1))
+    if n <= 0:
+        return None
+    months, days = _UNITS[m.group(2)[0]]
+    if months * n > MAX_CYCLE_MONTHS or days * n > MAX_CYCLE_DAYS:
+        return None
+    return Cycle(months=months * n, days=days * n)
+
+
+def add_months(d: date, months: int, anchor_day: Optional[int] = None) -> date:
+    """Shift d by whole months, keeping anchor_day (default d.day) clamped to the month's length."""
+    y, m = divmod(d.month - 1 + months, 12)
+    year, month = d.year + y, m + 1
+    return date(year, month, min(anchor_day or d.day, calendar.monthrange(year, month)[1]))
+
+
+def next_due(current: date, cycle: Cycle, today: date, anchor_day: Optional[int] = None) -> date:
+    """First charge date on or after today, stepping from current by whole cycles.
+
+    Steps are computed arithmetically, so a date that is years stale costs the same
+    as one that is a day stale.
+    """
+    if current >= today:
+        return current
+    if cycle.days:
+        steps = -(-(today - current).days // cycle.days)
+        return current + timedelta(days=steps * cycle.days)
+    months_behind = (today.year - current.year) * 12 + today.month - current.month
+    steps = max(1, -(-months_behind // cycle.months))
+    due = add_months(current, steps * cycle.months, anchor_day)
+    if due < today:
+        due = add_months(current, (steps + 1) * cycle.months, anchor_day)
+    return due
@@ -3,12 +3,92 @@ import os
 # --- Config (из .env) ---
 DATABASE_URL = os.getenv("DATABASE_URL")
 SECRET_KEY = os.getenv("SECRET_KEY")
+INTERNAL_API_KEY = os.getenv("INTERNAL_API_KEY")  # unset -> /internal/* is disabled
+
+# --- DB pool ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds, -1 disables
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# --- Pagination ---
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "1000"))
+
+# --- Search ---
+SEARCH_LIMIT_DEFAULT = int(os.getenv("SEARCH_LIMIT_DEFAULT", "20"))
+SEARCH_LIMIT_MAX = int(os.getenv("SEARCH_LIMIT_MAX", "100"))
+
+# --- Upcoming billings ---
+UPCOMING_DAYS_DEFAULT = int(os.getenv("UPCOMING_DAYS_DEFAULT", "7"))
+UPCOMING_DAYS_MAX = int(os.getenv("UPCOMING_DAYS_MAX", "366"))
+
+# --- FX ---
+FX_RATES_PATH = os.getenv("FX_RATES_PATH")  # JSON or CSV rate table; unset -> same-currency only
+FX_CACHE_TTL = float(os.getenv("FX_CACHE_TTL", "3600"))  # seconds before the file is re-checked, 0 = never
+
+# --- Forecast ---
+FORECAST_MONTHS_DEFAULT = int(os.getenv("FORECAST_MONTHS_DEFAULT", "12"))
+FORECAST_MONTHS_MAX = int(os.getenv("FORECAST_MONTHS_MAX", "60"))
+
+# --- Billing rollover job ---
+ROLLOVER_INTERVAL = float(os.getenv("ROLLOVER_INTERVAL", "3600"))  # seconds between runs, 0 disables
+ROLLOVER_BATCH_SIZE = int(os.getenv("ROLLOVER_BATCH_SIZE", "1000"))  # rows per UPDATE/transaction
+
+# --- Batch ---
+CARD_BATCH_MAX = int(os.getenv("CARD_BATCH_MAX", "1000"))
+
+# --- Export ---
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))  # rows per server-side cursor fetch
+
+# --- Import ---
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))  # rows validated + inserted per transaction
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))  # rejected rows echoed back in the summary
+IMPORT_MAX_LINE = int(os.getenv("IMPORT_MAX_LINE", str(1024 * 1024)))  # characters; a longer line stops the import
+
+# --- Profiling ---
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "500"))  # log requests slower than this, 0 = off
+PROFILE_MAX_STATEMENTS = int(os.getenv("PROFILE_MAX_STATEMENTS", "20"))  # log requests issuing more, 0 = off
+PROFILE_REPEAT_THRESHOLD = int(os.getenv("PROFILE_REPEAT_THRESHOLD", "5"))  # same SQL this often in one request = N+1
 
 # --- JWT ---
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
+# --- Auth cache ---
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))  # seconds, also capped by token exp
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "4096"))  # verified tokens kept per worker, 0 disables
+JWT_CACHE_TTL = int(os.getenv("JWT_CACHE_TTL", "300"))  # seconds, also capped by token exp
+# Seconds between checks of the shared revocation version; bounds how late a worker sees
+# a /logout or revoke-tokens made in another worker. 0 = check on every request.
+AUTH_REVOCATION_CHECK = float(os.getenv("AUTH_REVOCATION_CHECK", "1"))
+
 # --- KDF ---
-KDF_ITERS = 200_000
+# Parameters for new verifiers; users on anything else are rehashed on their next login.
+# Tune with: python -m app.manage calibrate-kdf --target-ms 250
+KDF_ALGORITHM = os.getenv("KDF_ALGORITHM", "pbkdf2-sha256")  # "pbkdf2-sha256" | "pbkdf2-sha512"
+KDF_ITERS = int(os.getenv("KDF_ITERS", "200000"))
+# What verifiers stored before the parameters were recorded (NULL columns) were made with
+KDF_LEGACY_ALGORITHM = "pbkdf2-sha256"
+KDF_LEGACY_ITERS = 200_000
 SALT_SIZE = 16
-NONCE_LEN = 12
\ No newline at end of file
+NONCE_LEN = 12
+
+# --- Login throttling ---
+# Token buckets checked before any KDF work: burst attempts, refilled at rate per second (0 = off)
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", "20"))
+LOGIN_IP_RATE = float(os.getenv("LOGIN_IP_RATE", "0.5"))
+LOGIN_USER_BURST = int(os.getenv("LOGIN_USER_BURST", "5"))
+LOGIN_USER_RATE = float(os.getenv("LOGIN_USER_RATE", "0.05"))  # one attempt per 20s once the burst is spent
+# Clients that log in on behalf of many users (the bot) skip the per-IP bucket; comma-separated IPs/CIDRs
+LOGIN_IP_EXEMPT = [n.strip() for n in os.getenv("LOGIN_IP_EXEMPT", "").split(",") if n.strip()]
+RATELIMIT_MAX_KEYS = int(os.getenv("RATELIMIT_MAX_KEYS", "100000"))  # in-memory buckets kept per worker
+RATELIMIT_REDIS_URL = os.getenv("RATELIMIT_REDIS_URL")  # e.g. redis://redis:6379/0; shares buckets across workers
+
+# --- KDF pool ---
+KDF_POOL_KIND = os.getenv("KDF_POOL_KIND", "process")  # "process" | "thread"
+KDF_POOL_SIZE = int(os.getenv("KDF_POOL_SIZE", str(os.cpu_count() or 1)))
+KDF_QUEUE_SIZE = int(os.getenv("KDF_QUEUE_SIZE", str(2 * KDF_POOL_SIZE)))
+KDF_RETRY_AFTER = int(os.getenv("KDF_RETRY_AFTER", "1"))  # seconds, sent with 503
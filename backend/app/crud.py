@@ -1,26 +1,117 @@
-from sqlalchemy.orm import Session
-import os
+from datetime import date, datetime
+from typing import List, Optional, Tuple, Union
+from sqlalchemy import and_, delete, func, insert, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 import base64
-from . import models, schemas, crypto
-from .config import SALT_SIZE
+import binascii
+import json
+import sys
+from . import models, schemas
+from .config import EXPORT_CHUNK_SIZE
+
+# --- Pagination ---
+# Cursors are opaque to clients: urlsafe base64 of the JSON keyset of the last row
+def encode_cursor(*key) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key, default=str).encode()).decode('ascii')
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except ValueError:
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, list):
+        raise ValueError('Invalid cursor')
+    return key
 
 # --- User ---
-def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
-
-def create_user(db: Session, user: schemas.UserCreate):
-    salt = os.urandom(SALT_SIZE)
-    verifier = crypto.make_password_verifier(user.password, salt)
-    db_user = models.User(
-        username=user.username,
-        password_salt=salt,
-        password_verifier=verifier
+async def get_user_by_username(db: AsyncSession, username: str):
+    return await db.scalar(select(models.User).where(models.User.username == username))
+
+# Writes are single statements with RETURNING: no SELECT before UPDATE/DELETE
+# and no refresh SELECT after INSERT.
+async def create_user(db: AsyncSession, user: schemas.UserCreate, salt: bytes, verifier: bytes,
+                      kdf_algorithm: str, kdf_iterations: int):
+    db_user = await db.scalar(
+        insert(models.User)
+        .values(username=user.username, password_salt=salt, password_verifier=verifier,
+                kdf_algorithm=kdf_algorithm, kdf_iterations=kdf_iterations)
+        .returning(models.User)
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
     return db_user
 
+async def update_user_verifier(db: AsyncSession, user_id: int, old_verifier: bytes, salt: bytes, verifier: bytes,
+                               kdf_algorithm: str, kdf_iterations: int) -> bool:
+    # Guarded by the old verifier: a concurrent rehash of the same login is a harmless no-op
+    result = await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id, models.User.password_verifier == old_verifier)
+        .values(password_salt=salt, password_verifier=verifier,
+                kdf_algorithm=kdf_algorithm, kdf_iterations=kdf_iterations)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+# --- Token revocation ---
+async def get_revocation_version(db: AsyncSession) -> int:
+    return await db.scalar(select(models.AuthState.revocation_version).where(models.AuthState.id == 1)) or 0
+
+async def _bump_revocation_version(db: AsyncSession):
+    # Inside the revoking transaction; the row is created by the first revocation
+    result = await db.execute(
+        update(models.AuthState)
+        .where(models.AuthState.id == 1)
+        .values(revocation_version=models.AuthState.revocation_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if not result.rowcount:
+        await db.execute(insert(models.AuthState).values(id=1, revocation_version=1))
+
+async def is_token_revoked(db: AsyncSession, token_hash: bytes) -> bool:
+    return await db.scalar(
+        select(models.RevokedToken.token_hash).where(models.RevokedToken.token_hash == token_hash)
+    ) is not None
+
+async def revoke_token(db: AsyncSession, token_hash: bytes, owner_id: int, expires_at: datetime):
+    # Expired rows can't match a valid token any more; pruned here instead of by a job
+    await db.execute(delete(models.RevokedToken).where(models.RevokedToken.expires_at < datetime.utcnow()))
+    try:
+        await db.execute(insert(models.RevokedToken).values(
+            token_hash=token_hash, owner_id=owner_id, expires_at=expires_at))
+        await _bump_revocation_version(db)
+        await db.commit()
+    except IntegrityError:
+        # Already revoked (e.g. a repeated /logout)
+        await db.rollback()
+
+async def revoke_user_tokens(db: AsyncSession, username: str, at: datetime) -> Optional[int]:
+    """Reject every token of the user issued before `at`; returns the user id or None."""
+    user_id = await db.scalar(
+        update(models.User)
+        .where(models.User.username == username)
+        .values(tokens_revoked_at=at)
+        .returning(models.User.id)
+    )
+    if user_id is not None:
+        await _bump_revocation_version(db)
+    await db.commit()
+    return user_id
+
+# --- Data version ---
+async def get_data_version(db: AsyncSession, user_id: int) -> int:
+    return await db.scalar(select(models.User.data_version).where(models.User.id == user_id))
+
+async def bump_data_version(db: AsyncSession, user_id: int):
+    # Runs inside the caller's transaction, so the bump commits together with the write
+    await db.execute(
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(data_version=models.User.data_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
 # --- Card ---
 # def create_user_card(db: Session, card: schemas.CardCreate, user: models.User):
 #     key = crypto.user_key_from_user(user)
@@ -43,64 +134,281 @@ def create_user(db: Session, user: schemas.UserCreate):
 #     db.refresh(db_card)
 #     return db_card
 
-def get_user_cards(db: Session, user_id: int):
-    return db.query(models.Card).filter(models.Card.owner_id == user_id).all()
+# List endpoints read plain column tuples (Row objects), not ORM instances
+CARD_LIST_COLUMNS = (models.Card.id, models.Card.label, models.Card.enc_data, models.Card.nonce, models.Card.created_at)
+
+async def get_user_cards(db: AsyncSession, user_id: int, limit: Optional[int] = None, after_id: Optional[int] = None):
+    stmt = select(*CARD_LIST_COLUMNS).where(models.Card.owner_id == user_id).order_by(models.Card.id)
+    if after_id is not None:
+        stmt = stmt.where(models.Card.id > after_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return (await db.execute(stmt)).all()
 
-def get_user_card(db: Session, card_id: int, user_id: int):
-    return db.query(models.Card).filter(models.Card.id == card_id, models.Card.owner_id == user_id).first()
+async def get_user_card(db: AsyncSession, card_id: int, user_id: int):
+    return await db.scalar(select(models.Card).where(models.Card.id == card_id, models.Card.owner_id == user_id))
 
-def delete_user_card(db: Session, card_id: int, user_id: int):
-    db_card = get_user_card(db, card_id, user_id)
-    if not db_card:
+async def delete_user_card(db: AsyncSession, card_id: int, user_id: int):
+    deleted_id = await db.scalar(
+        delete(models.Card)
+        .where(models.Card.id == card_id, models.Card.owner_id == user_id)
+        .returning(models.Card.id)
+    )
+    if deleted_id is None:
         return None
-    db.delete(db_card)
-    db.commit()
-    return db_card
+    await bump_data_version(db, user_id)
+    await db.commit()
+    return deleted_id
 
 # --- Card Raw ---
-def create_user_card(db: Session, raw: schemas.RawCardIn, user_id: int):
-    ct = base64.b64decode(raw.enc_data_b64)
-    nonce = base64.b64decode(raw.nonce_b64)
-    db_card = models.Card(
-        owner_id=user_id,
-        label=raw.label,
-        enc_data=ct,
-        nonce=nonce
+def decode_raw_card(raw: Union[schemas.RawCardIn, schemas.RawCardBinIn]):
+    if isinstance(raw, schemas.RawCardBinIn):
+        return raw.enc_data, raw.nonce
+    # validate=True: anything outside the base64 alphabet is an error, not silently dropped
+    return base64.b64decode(raw.enc_data_b64, validate=True), base64.b64decode(raw.nonce_b64, validate=True)
+
+async def create_user_card(db: AsyncSession, raw: Union[schemas.RawCardIn, schemas.RawCardBinIn], user_id: int):
+    ct, nonce = decode_raw_card(raw)
+    db_card = await db.scalar(
+        insert(models.Card)
+        .values(owner_id=user_id, label=raw.label, enc_data=ct, nonce=nonce)
+        .returning(models.Card)
     )
-    db.add(db_card)
-    db.commit()
-    db.refresh(db_card)
+    await bump_data_version(db, user_id)
+    await db.commit()
     return db_card
 
+async def create_user_cards(db: AsyncSession, raws: List[Tuple[int, Union[schemas.RawCardIn, schemas.RawCardBinIn]]],
+                            user_id: int, partial: bool = False):
+    """Insert a batch of raw cards in one transaction.
+
+    `raws` is [(input_index, card)]. Returns (created, errors): created is
+    [(input_index, row, enc_data, nonce)] in input order, errors is
+    [(input_index, message)]. Unless `partial`, any error inserts nothing.
+    """
+    values, indexes, errors = [], [], []
+    for i, raw in raws:
+        try:
+            ct, nonce = decode_raw_card(raw)
+        except binascii.Error as e:
+            errors.append((i, f'Invalid base64: {e}'))
+            continue
+        values.append({'owner_id': user_id, 'label': raw.label, 'enc_data': ct, 'nonce': nonce})
+        indexes.append(i)
+    if not values or (errors and not partial):
+        return [], errors
+
+    # executemany with RETURNING; sort_by_parameter_order keeps rows aligned with `values`
+    stmt = insert(models.Card).returning(
+        models.Card.id, models.Card.label, models.Card.created_at, sort_by_parameter_order=True
+    )
+    rows = (await db.execute(stmt, values)).all()
+    await bump_data_version(db, user_id)
+    await db.commit()
+    return [(i, row, v['enc_data'], v['nonce']) for i, row, v in zip(indexes, rows, values)], errors
+
 # --- Subscription ---
-def create_user_sub(db: Session, sub: schemas.SubscriptionCreate, user_id: int):
-    db_sub = models.Subscription(**sub.dict(), owner_id=user_id)
-    db.add(db_sub)
-    db.commit()
-    db.refresh(db_sub)
+async def create_user_sub(db: AsyncSession, sub: schemas.SubscriptionCreate, user_id: int):
+    db_sub = await db.scalar(
+        insert(models.Subscription).values(**sub.dict(), owner_id=user_id).returning(models.Subscription)
+    )
+    await bump_data_version(db, user_id)
+    await db.commit()
     return db_sub
 
-def get_user_subs(db: Session, user_id: int):
-    return db.query(models.Subscription).filter(models.Subscription.owner_id == user_id).order_by(models.Subscription.next_billing_date.asc()).all()
+async def create_user_subs(db: AsyncSession, subs: List[schemas.SubscriptionCreate], user_id: int) -> int:
+    # One executemany INSERT + commit per chunk; nothing is loaded back
+    await db.execute(insert(models.Subscription), [{**s.dict(), 'owner_id': user_id} for s in subs])
+    await bump_data_version(db, user_id)
+    await db.commit()
+    return len(subs)
 
-def get_user_sub(db: Session, sub_id: int, user_id: int):
-    return db.query(models.Subscription).filter(models.Subscription.id == sub_id, models.Subscription.owner_id == user_id).first()
+# In SubscriptionOut field order, so row._asdict() is the response object as-is
+SUB_LIST_COLUMNS = tuple(
+    getattr(models.Subscription, name) for name in (
+        'service_name', 'cost', 'currency', 'billing_cycle', 'next_billing_date', 'start_date', 'notes', 'id', 'created_at'
+    )
+)
 
-def update_user_sub(db: Session, sub_id: int, sub_in: schemas.SubscriptionCreate, user_id: int):
-    db_sub = get_user_sub(db, sub_id, user_id)
-    if not db_sub:
-        return None
+async def get_user_subs(db: AsyncSession, user_id: int, limit: Optional[int] = None,
+                        after: Optional[Tuple[Optional[date], int]] = None):
+    """A user's subscriptions by (next_billing_date, id), undated ones last on every backend.
+
+    Dated and undated rows are separate range scans on (owner_id, next_billing_date, id);
+    the undated tail is only read once the dated rows run out.
+    """
+    Sub = models.Subscription
+    rows = []
+    if after is None or after[0] is not None:
+        key = (Sub.next_billing_date, Sub.id)
+        stmt = (
+            select(*SUB_LIST_COLUMNS)
+            .where(Sub.owner_id == user_id, Sub.next_billing_date.is_not(None))
+            .order_by(*key)
+        )
+        if after is not None:
+            stmt = stmt.where(tuple_(*key) > tuple_(*after))
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        rows = (await db.execute(stmt)).all()
+        if limit is not None and len(rows) >= limit:
+            return rows
+    stmt = select(*SUB_LIST_COLUMNS).where(Sub.owner_id == user_id, Sub.next_billing_date.is_(None)).order_by(Sub.id)
+    if after is not None and after[0] is None:
+        stmt = stmt.where(Sub.id > after[1])
+    if limit is not None:
+        stmt = stmt.limit(limit - len(rows))
+    return rows + (await db.execute(stmt)).all()
+
+# Just what a billing reminder needs
+UPCOMING_COLUMNS = tuple(
+    getattr(models.Subscription, name) for name in ('id', 'service_name', 'cost', 'currency', 'next_billing_date')
+)
+
+async def get_upcoming_subs(db: AsyncSession, start: date, end: date, user_id: Optional[int] = None,
+                            limit: Optional[int] = None, after: Optional[tuple] = None):
+    """Subscriptions billing in [start, end], as a range scan on next_billing_date.
+
+    With user_id the (owner_id, next_billing_date, id) index is used and the keyset
+    is (next_billing_date, id). Without it every user is included, rows carry
+    owner_id/username and the keyset is (next_billing_date, owner_id, id).
+    """
+    Sub = models.Subscription
+    if user_id is not None:
+        stmt = select(*UPCOMING_COLUMNS).where(Sub.owner_id == user_id)
+        key = (Sub.next_billing_date, Sub.id)
+    else:
+        stmt = (
+            select(*UPCOMING_COLUMNS, Sub.owner_id, models.User.username)
+            .join(models.User, models.User.id == Sub.owner_id)
+        )
+        key = (Sub.next_billing_date, Sub.owner_id, Sub.id)
+    stmt = stmt.where(Sub.next_billing_date >= start, Sub.next_billing_date <= end).order_by(*key)
+    if after is not None:
+        stmt = stmt.where(tuple_(*key) > tuple_(*after))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return (await db.execute(stmt)).all()
+
+async def get_user_sub(db: AsyncSession, sub_id: int, user_id: int):
+    return await db.scalar(select(models.Subscription).where(models.Subscription.id == sub_id, models.Subscription.owner_id == user_id))
+
+async def update_user_sub(db: AsyncSession, sub_id: int, sub_in: schemas.SubscriptionCreate, user_id: int):
     update_data = sub_in.dict(exclude_unset=True)
-    for key, value in update_data.items():
-        setattr(db_sub, key, value)
-    db.commit()
-    db.refresh(db_sub)
+    db_sub = await db.scalar(
+        update(models.Subscription)
+        .where(models.Subscription.id == sub_id, models.Subscription.owner_id == user_id)
+        .values(**update_data)
+        .returning(models.Subscription)
+        .execution_options(synchronize_session=False)
+    )
+    if db_sub is None:
+        return None
+    await bump_data_version(db, user_id)
+    await db.commit()
     return db_sub
 
-def delete_user_sub(db: Session, sub_id: int, user_id: int):
-    db_sub = get_user_sub(db, sub_id, user_id)
-    if not db_sub:
+async def delete_user_sub(db: AsyncSession, sub_id: int, user_id: int):
+    deleted_id = await db.scalar(
+        delete(models.Subscription)
+        .where(models.Subscription.id == sub_id, models.Subscription.owner_id == user_id)
+        .returning(models.Subscription.id)
+    )
+    if deleted_id is None:
         return None
-    db.delete(db_sub)
-    db.commit()
-    return db_sub
\ No newline at end of file
+    await bump_data_version(db, user_id)
+    await db.commit()
+    return deleted_id
+
+# --- Search ---
+def _escape_like(s: str) -> str:
+    return s.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _folded(db: AsyncSession, col):
+    # Postgres lower() is Unicode-aware; on SQLite it is ASCII-only, so use fold() (db.py)
+    return func.lower(col) if db.bind.dialect.name == 'postgresql' else func.fold(col)
+
+def _search_filter(db: AsyncSession, col, q: str, mode: str):
+    """Case-insensitive match on the folded column, phrased so the search indexes apply.
+
+    Postgres: LIKE against the lower(col) gin_trgm_ops index, for both modes.
+    SQLite: a [q, q+1) range on the (owner_id, fold(col)) index for prefixes and
+    instr() over that covering index for substrings.
+    """
+    expr = _folded(db, col)
+    needle = q.lower()
+    if db.bind.dialect.name == 'postgresql':
+        pattern = f'{_escape_like(needle)}%' if mode == 'prefix' else f'%{_escape_like(needle)}%'
+        return expr.like(pattern, escape='\\')
+    if mode == 'prefix':
+        # Smallest string above every one starting with needle: bump the last
+        # character that can be bumped; none left (all U+10FFFF) means no bound
+        stem = needle.rstrip(chr(sys.maxunicode))
+        if not stem:
+            return expr >= needle
+        bump = ord(stem[-1]) + 1
+        if 0xD800 <= bump <= 0xDFFF:  # surrogates can't be encoded; next code point is U+E000
+            bump = 0xE000
+        return and_(expr >= needle, expr < stem[:-1] + chr(bump))
+    return func.instr(expr, needle) > 0
+
+async def search_user_subs(db: AsyncSession, user_id: int, q: str, mode: str, limit: int):
+    Sub = models.Subscription
+    stmt = (
+        select(*SUB_LIST_COLUMNS)
+        .where(Sub.owner_id == user_id, _search_filter(db, Sub.service_name, q, mode))
+        .order_by(_folded(db, Sub.service_name), Sub.id)
+        .limit(limit)
+    )
+    return (await db.execute(stmt)).all()
+
+async def search_user_cards(db: AsyncSession, user_id: int, q: str, mode: str, limit: int):
+    Card = models.Card
+    stmt = (
+        select(*CARD_LIST_COLUMNS)
+        .where(Card.owner_id == user_id, _search_filter(db, Card.label, q, mode))
+        .order_by(_folded(db, Card.label), Card.id)
+        .limit(limit)
+    )
+    return (await db.execute(stmt)).all()
+
+# --- Export ---
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii')
+
+async def _stream(db: AsyncSession, stmt, chunk_size: int):
+    # yield_per -> server-side cursor on Postgres, so only one chunk is ever in memory
+    result = await db.stream(stmt.execution_options(yield_per=chunk_size))
+    async for row in result:
+        yield row
+
+async def iter_vault(db: AsyncSession, user_id: Optional[int] = None, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Yield export records (plain dicts) for one user, or for every user when user_id is None.
+
+    Cards stay encrypted; the all-users export also carries the users table so
+    a backup can be restored with working logins.
+    """
+    User, Card, Sub = models.User, models.Card, models.Subscription
+    if user_id is None:
+        # The verifier is useless without the KDF parameters it was derived with
+        # (NULL = legacy defaults); tokens_revoked_at keeps revoked sessions dead
+        stmt = select(User.id, User.username, User.password_salt, User.password_verifier, User.kdf_algorithm,
+                      User.kdf_iterations, User.tokens_revoked_at, User.created_at).order_by(User.id)
+        async for r in _stream(db, stmt, chunk_size):
+            yield {'type': 'user', 'id': r.id, 'username': r.username, 'password_salt_b64': _b64(r.password_salt),
+                   'password_verifier_b64': _b64(r.password_verifier), 'kdf_algorithm': r.kdf_algorithm,
+                   'kdf_iterations': r.kdf_iterations, 'tokens_revoked_at': r.tokens_revoked_at,
+                   'created_at': r.created_at}
+
+    stmt = select(Card.id, Card.owner_id, Card.label, Card.enc_data, Card.nonce, Card.created_at).order_by(Card.owner_id, Card.id)
+    if user_id is not None:
+        stmt = stmt.where(Card.owner_id == user_id)
+    async for r in _stream(db, stmt, chunk_size):
+        yield {'type': 'card', 'id': r.id, 'owner_id': r.owner_id, 'label': r.label,
+               'enc_data_b64': _b64(r.enc_data), 'nonce_b64': _b64(r.nonce), 'created_at': r.created_at}
+
+    stmt = select(*Sub.__table__.columns).order_by(Sub.owner_id, Sub.id)
+    if user_id is not None:
+        stmt = stmt.where(Sub.owner_id == user_id)
+    async for r in _stream(db, stmt, chunk_size):
+        yield {'type': 'subscription', **r._asdict()}
@@ -5,19 +5,33 @@ from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
-from .config import KDF_ITERS, NONCE_LEN, SALT_SIZE
+from typing import Tuple
+from .config import KDF_ALGORITHM, KDF_ITERS, KDF_LEGACY_ALGORITHM, KDF_LEGACY_ITERS, NONCE_LEN, SALT_SIZE
 from . import models
 
-def derive_key(password: str, salt: bytes) -> bytes:
+KDF_HASHES = {'pbkdf2-sha256': hashes.SHA256, 'pbkdf2-sha512': hashes.SHA512}
+if KDF_ALGORITHM not in KDF_HASHES:
+    raise ValueError(f'Unknown KDF_ALGORITHM: {KDF_ALGORITHM!r}')
+
+def derive_key(password: str, salt: bytes, iterations: int = KDF_ITERS, algorithm: str = KDF_ALGORITHM) -> bytes:
     kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
+        algorithm=KDF_HASHES[algorithm](),
         length=32,
         salt=salt,
-        iterations=KDF_ITERS,
+        iterations=iterations,
         backend=default_backend()
     )
     return kdf.derive(password.encode('utf-8'))
 
+# --- KDF parameters ---
+def user_kdf_params(user: models.User) -> Tuple[str, int]:
+    # NULL columns: the verifier predates stored parameters
+    return user.kdf_algorithm or KDF_LEGACY_ALGORITHM, user.kdf_iterations or KDF_LEGACY_ITERS
+
+def needs_rehash(user: models.User) -> bool:
+    # Either direction: lowering KDF_ITERS for throughput migrates users too
+    return user_kdf_params(user) != (KDF_ALGORITHM, KDF_ITERS)
+
 def encrypt_payload(key: bytes, payload: dict):
     aesgcm = AESGCM(key)
     nonce = os.urandom(NONCE_LEN)
@@ -30,12 +44,14 @@ def decrypt_payload(key: bytes, nonce: bytes, ct: bytes):
     data = aesgcm.decrypt(nonce, ct, None)
     return json.loads(data.decode('utf-8'))
 
-def make_password_verifier(password: str, salt: bytes) -> bytes:
-    return derive_key(password, salt)
+def make_password_verifier(password: str, salt: bytes, iterations: int = KDF_ITERS,
+                           algorithm: str = KDF_ALGORITHM) -> bytes:
+    return derive_key(password, salt, iterations, algorithm)
 
-def verify_password(password: str, salt: bytes, verifier: bytes) -> bool:
+def verify_password(password: str, salt: bytes, verifier: bytes, iterations: int = KDF_LEGACY_ITERS,
+                    algorithm: str = KDF_LEGACY_ALGORITHM) -> bool:
     try:
-        candidate = derive_key(password, salt)
+        candidate = derive_key(password, salt, iterations, algorithm)
         return secrets.compare_digest(candidate, verifier)
     except Exception:
         return False
@@ -1,8 +1,163 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from .config import DATABASE_URL
-
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+import threading
+import time
+from typing import Optional
+from sqlalchemy import event, exc
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from . import profiling
+from .config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+)
+
+# Async driver per backend; sync URLs from .env (postgresql+psycopg2://, sqlite://) are rewritten
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+def async_url(url: str) -> URL:
+    u = make_url(url)
+    driver = ASYNC_DRIVERS.get(u.get_backend_name())
+    if driver and u.get_driver_name() != driver:
+        u = u.set(drivername=f"{u.get_backend_name()}+{driver}")
+    return u
+
+# --- Pool statistics ---
+class PoolStats:
+    """Counters fed by pool events plus checkout wait times from TimedQueuePool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.waits += 1
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+
+    def snapshot(self, pool) -> dict:
+        out = {
+            "pool": type(pool).__name__,
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "invalidations": self.invalidations,
+            "timeouts": self.timeouts,
+            "wait_count": self.waits,
+            "wait_total_seconds": self.wait_total,
+            "wait_avg_seconds": self.wait_total / self.waits if self.waits else 0.0,
+            "wait_max_seconds": self.wait_max,
+        }
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            out.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                idle=pool.checkedin(),
+                overflow=pool.overflow(),
+                max_overflow=pool._max_overflow,
+            )
+        return out
+
+pool_stats = PoolStats()
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # There is no "checkout started" pool event, so time the blocking get here
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            pool_stats.timeouts += 1
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - started)
+
+def _engine_options(url: URL) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    # In-memory SQLite runs on a StaticPool, which takes no sizing arguments
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return options
+
+def _listen_pool_events(engine):
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, record):
+        pool_stats.connects += 1
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_conn, record, proxy):
+        pool_stats.checkouts += 1
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_conn, record):
+        pool_stats.checkins += 1
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_conn, record, exception):
+        pool_stats.invalidations += 1
+
+# --- SQLite functions ---
+# SQLite's lower() folds ASCII only; search and its expression indexes use fold()
+# instead, so every connection (including `manage migrate`) must register it.
+# Writing cards/subscriptions needs it too (the indexes are maintained through it),
+# so other SQLite clients (sqlite3 shell, DB browsers) can only read those tables.
+def _fold(value):
+    return value.lower() if isinstance(value, str) else value
+
+def register_sqlite_functions(engine):
+    """Register fold() on every new connection of a sync SQLite engine (or AsyncEngine.sync_engine)."""
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_conn, record):
+        dbapi_conn.create_function("fold", 1, _fold, deterministic=True)
+
+# --- Engine (created on first use) ---
+# Importing the app never touches DATABASE_URL or the network; the engine is built
+# by the first session or by `python -m app.manage`, and connects on first query.
+_engine: Optional[AsyncEngine] = None
+_session_factory = async_sessionmaker(class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def get_engine() -> AsyncEngine:
+    global _engine
+    if _engine is None:
+        if not DATABASE_URL:
+            raise RuntimeError("DATABASE_URL is not set")
+        url = async_url(DATABASE_URL)
+        _engine = create_async_engine(url, **_engine_options(url))
+        _listen_pool_events(_engine.sync_engine)
+        if url.get_backend_name() == "sqlite":
+            register_sqlite_functions(_engine.sync_engine)
+        profiling.instrument_engine(_engine.sync_engine)
+        _session_factory.configure(bind=_engine)
+    return _engine
+
+def SessionLocal() -> AsyncSession:
+    get_engine()
+    return _session_factory()
+
+async def dispose_engine():
+    global _engine
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = None
+
+Base = declarative_base()
+
+def get_pool_stats() -> dict:
+    if _engine is None:
+        return {"pool": None, "connected": False}
+    return pool_stats.snapshot(_engine.sync_engine.pool)
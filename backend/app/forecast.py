@@ -0,0 +1,166 @@
+from datetime import date
+from typing import Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import billing, fx, models
+
+Sub = models.Subscription
+
+# Upper bound on the (subscriptions x steps) matrix built at once; bigger groups are chunked
+MAX_CELLS = 4_000_000
+
+_ONE_MONTH = np.timedelta64(1, 'M')
+
+
+def day_of_month(d: np.ndarray) -> np.ndarray:
+    return (d - d.astype('datetime64[M]')).astype(np.int64) + 1
+
+
+def _chunks(n: int, steps: int):
+    size = max(1, MAX_CELLS // max(steps, 1))
+    for lo in range(0, n, size):
+        yield slice(lo, min(lo + size, n))
+
+
+def _expand_days(first, step, start, end):
+    # k0: first step that lands on or after start (0 if first is already in the window)
+    lag = (start - first).astype(np.int64)
+    k0 = np.maximum(0, -(-lag // step))
+    base = first + (k0 * step).astype('timedelta64[D]')
+    steps = int((end - start).astype(np.int64) // step) + 1
+    offsets = (np.arange(steps) * step).astype('timedelta64[D]')
+    for sl in _chunks(len(first), steps):
+        dates = base[sl, None] + offsets
+        rows, cols = np.nonzero(dates < end)
+        yield rows + sl.start, dates[rows, cols]
+
+
+def _expand_months(first, step, anchor, start, end):
+    first_m = first.astype('datetime64[M]')
+    start_m = start.astype('datetime64[M]')
+    lag = (start_m - first_m).astype(np.int64)
+    k0 = np.maximum(0, -(-lag // step))
+    steps = int((end.astype('datetime64[M]') - start_m).astype(np.int64) // step) + 2
+    for sl in _chunks(len(first), steps):
+        k = k0[sl, None] + np.arange(steps)
+        months = first_m[sl, None] + (k * step).astype('timedelta64[M]')
+        month_len = ((months + _ONE_MONTH).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(np.int64)
+        dates = months.astype('datetime64[D]') + (np.minimum(anchor[sl, None], month_len) - 1).astype('timedelta64[D]')
+        # Step 0 is the stored date itself, whatever the anchor says (same as billing.next_due)
+        dates = np.where(k == 0, first[sl, None], dates)
+        rows, cols = np.nonzero((dates >= start) & (dates < end))
+        yield rows + sl.start, dates[rows, cols]
+
+
+def expand_schedules(first: np.ndarray, months: np.ndarray, days: np.ndarray, anchor: np.ndarray,
+                     start: np.datetime64, end: np.datetime64) -> Tuple[np.ndarray, np.ndarray]:
+    """Every charge date in [start, end) for a batch of schedules.
+
+    first is datetime64[D] (the stored next charge), months/days the cycle step
+    (exactly one non-zero per row), anchor the day of month monthly cycles keep.
+    Rows sharing a cycle are expanded together as a (rows x steps) matrix, so the
+    Python-level loop runs once per distinct cycle, not once per subscription.
+    Returns (row index, date) arrays sorted by date then row.
+    """
+    start = np.datetime64(start, 'D')
+    end = np.datetime64(end, 'D')
+    idx_parts, date_parts = [np.empty(0, np.int64)], [np.empty(0, 'datetime64[D]')]
+    for m, d in set(zip(months.tolist(), days.tolist())):
+        sel = np.nonzero((months == m) & (days == d))[0]
+        if d:
+            parts = _expand_days(first[sel], d, start, end)
+        else:
+            parts = _expand_months(first[sel], m, anchor[sel], start, end)
+        for rows, dates in parts:
+            idx_parts.append(sel[rows])
+            date_parts.append(dates)
+    idx = np.concatenate(idx_parts)
+    dates = np.concatenate(date_parts)
+    order = np.lexsort((idx, dates))
+    return idx[order], dates[order]
+
+
+async def subscription_forecast(db: AsyncSession, user_id: int, months: int, charges: bool = True,
+                                rates: Optional[fx.FxRates] = None, currency: Optional[str] = None) -> dict:
+    """Projected charges per calendar month from today through `months` months ahead.
+
+    With rates/currency each month also gets converted_total: the per-currency
+    totals matrix times one rate per currency.
+    """
+    rows = (await db.execute(
+        select(Sub.id, Sub.service_name, Sub.cost, Sub.currency,
+               func.coalesce(Sub.billing_cycle, billing.DEFAULT_CYCLE), Sub.next_billing_date, Sub.start_date)
+        .where(Sub.owner_id == user_id)
+        .order_by(Sub.id)
+    )).all()
+
+    today = date.today()
+    end = billing.add_months(today, months)
+    start_d, end_d = np.datetime64(today, 'D'), np.datetime64(end, 'D')
+    month_keys = np.arange(start_d.astype('datetime64[M]'), (end_d - 1).astype('datetime64[M]') + 1)
+    result = {'start': today, 'end': end, 'months': [], 'unscheduled': 0, 'unrecognized_cycles': [],
+              'currency': currency, 'unconverted_currencies': []}
+
+    if rows:
+        ids, names, cost, currencies, cycle, next_date, start_date = zip(*rows)
+        cost = np.array(cost, dtype=np.float64)
+        next_date = np.array(next_date, dtype='datetime64[D]')
+        start_date = np.array(start_date, dtype='datetime64[D]')
+
+        # Cycles and currencies are parsed/encoded once per distinct value
+        cycle_names, cycle_code = np.unique(np.array(cycle, dtype=object), return_inverse=True)
+        parsed = [billing.parse_cycle(c) for c in cycle_names]
+        step_m = np.array([c.months if c else 0 for c in parsed], dtype=np.int64)[cycle_code]
+        step_d = np.array([c.days if c else 0 for c in parsed], dtype=np.int64)[cycle_code]
+        known = np.array([c is not None for c in parsed])[cycle_code]
+        result['unrecognized_cycles'] = sorted(n for n, c in zip(cycle_names.tolist(), parsed) if c is None)
+
+        # Undated subscriptions fall back to start_date; with neither there is no schedule
+        first = np.where(np.isnat(next_date), start_date, next_date)
+        anchor = np.where(np.isnat(start_date), day_of_month(first), day_of_month(start_date))
+        valid = known & ~np.isnat(first)
+        result['unscheduled'] = int((~valid).sum())
+
+        sel = np.nonzero(valid)[0]
+        idx, dates = expand_schedules(first[sel], step_m[sel], step_d[sel], anchor[sel], start_d, end_d)
+        idx = sel[idx]
+
+        cur_names, cur_code = np.unique(np.array(currencies, dtype=object), return_inverse=True)
+        month_pos = (dates.astype('datetime64[M]') - month_keys[0]).astype(np.int64)
+        totals = np.bincount(
+            month_pos * len(cur_names) + cur_code[idx], weights=cost[idx], minlength=len(month_keys) * len(cur_names)
+        ).reshape(len(month_keys), len(cur_names))
+        counts = np.bincount(month_pos, minlength=len(month_keys))
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        date_list, idx_list = dates.tolist(), idx.tolist()
+        cur_list = cur_names.tolist()
+    else:
+        totals = np.zeros((len(month_keys), 0))
+        bounds = np.zeros(len(month_keys) + 1, dtype=np.int64)
+        cur_list = []
+
+    converted = None
+    if currency:
+        factors = np.array([rates.convert(1.0, cur, currency) or np.nan for cur in cur_list], dtype=np.float64)
+        result['unconverted_currencies'] = [cur for cur, f in zip(cur_list, factors) if np.isnan(f)]
+        converted = totals @ np.nan_to_num(factors)
+
+    for pos, key in enumerate(month_keys.tolist()):
+        entry = {
+            'month': key.strftime('%Y-%m'),
+            'totals': {cur: round(float(v), 2) for cur, v in zip(cur_list, totals[pos]) if v},
+        }
+        if converted is not None:
+            entry['converted_total'] = round(float(converted[pos]), 2)
+        if charges:
+            entry['charges'] = [
+                {'id': ids[i], 'service_name': names[i], 'date': date_list[j], 'amount': cost[i].item(),
+                 'currency': currencies[i]}
+                for j in range(bounds[pos], bounds[pos + 1])
+                for i in (idx_list[j],)
+            ]
+        result['months'].append(entry)
+    return result
@@ -0,0 +1,139 @@
+import csv
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from .config import FX_RATES_PATH, FX_CACHE_TTL
+
+# Rate table format (FX_RATES_PATH), either
+#   JSON: {"base": "USD", "rates": {"EUR": 0.92, "RUB": 95.1}}
+#   CSV:  currency,rate   (rates against the first row whose rate is 1, else USD)
+# A rate is how many units of that currency one unit of the base buys.
+
+
+class UnknownCurrency(ValueError):
+    pass
+
+
+def normalize(currency: str) -> str:
+    return (currency or '').strip().upper()
+
+
+def _read(path: str):
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            rates = {normalize(r['currency']): float(r['rate']) for r in csv.DictReader(f) if r.get('currency')}
+            base = next((c for c, r in rates.items() if r == 1), 'USD')
+            return base, rates
+        data = json.load(f)
+    return normalize(data.get('base', 'USD')), {normalize(c): float(r) for c, r in data['rates'].items()}
+
+
+class FxRates:
+    """Immutable snapshot of one rate table. Pair rates are memoised on first use."""
+
+    def __init__(self, base: str = 'USD', rates: Optional[Dict[str, float]] = None, version: int = 0,
+                 source: Optional[str] = None):
+        self.base = base
+        self.rates = {base: 1.0, **(rates or {})}
+        if any(r <= 0 for r in self.rates.values()):
+            raise ValueError('FX rates must be positive')
+        self.version = version
+        self.source = source
+        self.loaded_at = time.time()
+        self._pairs: Dict[tuple, float] = {}
+
+    def rate(self, src: str, dst: str) -> float:
+        key = (src, dst)
+        try:
+            return self._pairs[key]
+        except KeyError:
+            pass
+        if src == dst:
+            r = 1.0
+        else:
+            try:
+                r = self.rates[dst] / self.rates[src]
+            except KeyError as e:
+                raise UnknownCurrency(f'No FX rate for {e.args[0]}') from None
+        self._pairs[key] = r
+        return r
+
+    def convert(self, amount: float, src: str, dst: str) -> Optional[float]:
+        """amount in dst, or None if src has no rate (dst is validated by the caller)."""
+        try:
+            return amount * self.rate(normalize(src), dst)
+        except UnknownCurrency:
+            return None
+
+    def check(self, currency: str) -> str:
+        currency = normalize(currency)
+        if currency not in self.rates:
+            raise UnknownCurrency(f'No FX rate for {currency or "empty currency"}')
+        return currency
+
+
+class FxCache:
+    """Holds the current FxRates; reloaded from `path` when older than `ttl` or on demand.
+
+    A failed reload keeps serving the previous table and records the error.
+    """
+
+    def __init__(self, path: Optional[str] = FX_RATES_PATH, ttl: float = FX_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._rates: Optional[FxRates] = None
+        self._mtime: Optional[float] = None
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+
+    def get(self) -> FxRates:
+        rates = self._rates
+        if rates is None or (self.ttl > 0 and time.time() - rates.loaded_at >= self.ttl):
+            rates = self.reload(force=False)
+        return rates
+
+    def reload(self, force: bool = True) -> FxRates:
+        with self._lock:
+            current = self._rates
+            if not self.path:
+                if current is None:
+                    self._rates = FxRates()
+                return self._rates
+            try:
+                mtime = os.path.getmtime(self.path)
+                if current is not None and not force and mtime == self._mtime:
+                    # Unchanged file: just restart the TTL
+                    current.loaded_at = time.time()
+                    return current
+                base, rates = _read(self.path)
+                self._rates = FxRates(base, rates, version=(current.version + 1) if current else 1, source=self.path)
+                self._mtime = mtime
+                self.reloads += 1
+                self.last_error = None
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.last_error = f'{type(e).__name__}: {e}'
+                if current is None:
+                    self._rates = FxRates()
+                else:
+                    current.loaded_at = time.time()
+            return self._rates
+
+    def stats(self) -> dict:
+        rates = self._rates
+        return {
+            'path': self.path,
+            'ttl': self.ttl,
+            'base': rates.base if rates else None,
+            'currencies': sorted(rates.rates) if rates else [],
+            'version': rates.version if rates else None,
+            'loaded_at': rates.loaded_at if rates else None,
+            'reloads': self.reloads,
+            'last_error': self.last_error,
+        }
+
+
+cache = FxCache()
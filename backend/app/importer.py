@@ -0,0 +1,115 @@
+import codecs
+import csv
+import json
+import re
+from typing import BinaryIO, Iterator, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import crud, schemas
+from .config import IMPORT_CHUNK_SIZE, IMPORT_MAX_ERRORS, IMPORT_MAX_LINE
+
+FORMATS = ('csv', 'ndjson')
+READ_SIZE = 64 * 1024
+_NEWLINE = re.compile(r'\r\n|\r|\n')
+
+
+def detect_format(filename: str, content_type: str) -> str:
+    name = (filename or '').lower()
+    ctype = (content_type or '').lower()
+    if name.endswith(('.ndjson', '.jsonl')) or 'ndjson' in ctype or 'jsonl' in ctype:
+        return 'ndjson'
+    if name.endswith('.csv') or 'csv' in ctype:
+        return 'csv'
+    raise ValueError('Cannot detect format, pass ?format=csv or ?format=ndjson')
+
+
+class LineTooLong(ValueError):
+    pass
+
+
+def _iter_text_lines(f: BinaryIO) -> Iterator[str]:
+    # Incremental decode of the spooled upload; holds at most one unfinished line
+    # (capped at IMPORT_MAX_LINE) plus one read block.
+    # Only \r, \n and \r\n end a line (what csv expects from newline=''):
+    # str.splitlines would also break on U+2028, U+0085 etc. inside JSON strings.
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    scan = 0  # pending[:scan] is known to hold no line break
+    while True:
+        block = f.read(READ_SIZE)
+        pending += decoder.decode(block, final=not block)
+        start = 0
+        for m in _NEWLINE.finditer(pending, scan):
+            if block and m.end() == len(pending) and m.group() == '\r':
+                break  # may be the first half of a \r\n split across reads
+            yield pending[start:m.end()]
+            start = m.end()
+        pending = pending[start:]
+        if len(pending) > IMPORT_MAX_LINE:
+            raise LineTooLong(f'line longer than {IMPORT_MAX_LINE} characters')
+        # Only the new text needs searching next time, plus a held-back trailing \r
+        scan = max(0, len(pending) - 1)
+        if not block:
+            if pending:
+                yield pending
+            return
+
+
+def iter_rows(f: BinaryIO, fmt: str) -> Iterator[Tuple[int, object]]:
+    """Yield (line_number, row) pairs; row is a dict, or an error message string."""
+    lines = _iter_text_lines(f)
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # Empty cells mean "not given" so schema defaults still apply
+            yield reader.line_num, {k: v for k, v in row.items() if k and v not in ('', None)}
+        return
+    for n, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield n, f'Invalid JSON: {e}'
+            continue
+        yield n, row if isinstance(row, dict) else 'Expected a JSON object'
+
+
+async def import_subscriptions(db: AsyncSession, f: BinaryIO, fmt: str, user_id: int) -> dict:
+    accepted = rejected = 0
+    errors = []
+    chunk = []
+
+    def reject(line: int, detail: str):
+        nonlocal rejected
+        rejected += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({'line': line, 'detail': detail})
+
+    rows = iter_rows(f, fmt)
+    line = 0
+    while True:
+        try:
+            line, row = next(rows)
+        except StopIteration:
+            break
+        except (UnicodeDecodeError, csv.Error, LineTooLong) as e:
+            # Unreadable from here on: keep what was imported, report where it stopped
+            reject(line + 1, f'Stopped reading file: {e}')
+            break
+        if isinstance(row, str):
+            reject(line, row)
+            continue
+        try:
+            chunk.append(schemas.SubscriptionCreate(**row))
+        except (ValidationError, TypeError) as e:
+            reject(line, str(e))
+            continue
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            accepted += await crud.create_user_subs(db, chunk, user_id)
+            chunk = []
+    if chunk:
+        accepted += await crud.create_user_subs(db, chunk, user_id)
+    return {'accepted': accepted, 'rejected': rejected, 'errors': errors}
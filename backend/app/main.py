@@ -1,16 +1,53 @@
-from fastapi import FastAPI
-from . import models
-from .db import engine
+import logging
+import time
+_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from . import kdf, metrics, ratelimit, rollover
+from .db import dispose_engine
 from .api import router
 
-# Создаем таблицы в БД при старте
-models.Base.metadata.create_all(bind=engine)
+log = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Схема создаётся отдельно (python -m app.manage migrate); к БД подключаемся при первом запросе
+    rollover.job.start()
+    log.info("Ready in %.3fs after import", time.perf_counter() - _started)
+    yield
+    await rollover.job.stop()
+    kdf.pool.shutdown()
+    await ratelimit.limiter.close()
+    await dispose_engine()
 
-app = FastAPI(title="Cards Vault API")
+app = FastAPI(title="Cards Vault API", lifespan=lifespan)
 
 # Подключаем все эндпоинты из api.py
 app.include_router(router, tags=["API"])
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.exception_handler(kdf.KdfBusy)
+async def kdf_busy_handler(request: Request, exc: kdf.KdfBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server busy, retry later"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(ratelimit.RateLimited)
+async def rate_limited_handler(request: Request, exc: ratelimit.RateLimited):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many login attempts, retry later"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
 
 @app.get("/", tags=["Health"])
 def read_root():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/metrics", include_in_schema=False)
+def read_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,176 @@
+"""Operational commands; run from backend/ with the same environment as the app.
+
+    python -m app.manage migrate          # create/upgrade the schema (run before starting workers)
+    python -m app.manage startup-time     # import-to-ready time of a fresh worker process
+    python -m app.manage calibrate-kdf    # KDF_ITERS for a target verification latency on this CPU
+
+Schema work lives here instead of in the app lifespan so that workers start
+without touching the database and imports work without one.
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from . import crypto, models
+from .config import KDF_ALGORITHM, KDF_ITERS, KDF_POOL_SIZE
+from .db import dispose_engine, get_engine
+
+metadata = models.Base.metadata
+
+
+def _index_names(conn) -> set:
+    # Name lookup straight from the catalog: the inspector skips expression indexes on SQLite
+    if conn.dialect.name == 'sqlite':
+        return {r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    if conn.dialect.name == 'postgresql':
+        return {r[0] for r in conn.execute(text('SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()'))}
+    insp = inspect(conn)
+    return {i['name'] for t in insp.get_table_names() for i in insp.get_indexes(t)}
+
+
+def _migrate_sync(conn) -> List[str]:
+    """Bring an existing database up to the models: new tables, new columns, new indexes.
+
+    Additive only; nothing is dropped or altered in place. Safe to run repeatedly.
+    """
+    actions = []
+    existing = set(inspect(conn).get_table_names())
+    # Also runs the metadata before_create hooks (pg_trgm extension)
+    metadata.create_all(conn)
+    actions += [f'create table {t.name}' for t in metadata.sorted_tables if t.name not in existing]
+
+    insp = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    for table in metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        have = {c['name'] for c in insp.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in have:
+                continue
+            if not column.nullable and column.server_default is None:
+                raise RuntimeError(f'Cannot add NOT NULL column {table.name}.{column.name} without a server default')
+            ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}'))
+            actions.append(f'add column {table.name}.{column.name}')
+
+    before = _index_names(conn)
+    for table in metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in before:
+                # Index.create honours ddl_if, so dialect-specific indexes are skipped elsewhere
+                index.create(conn)
+    actions += [f'create index {name}' for name in sorted(_index_names(conn) - before)]
+    return actions
+
+
+async def migrate() -> List[str]:
+    try:
+        async with get_engine().begin() as conn:
+            return await conn.run_sync(_migrate_sync)
+    finally:
+        await dispose_engine()
+
+
+_PROBE = '''
+import asyncio, json, sys, time
+t0 = time.perf_counter()
+from app.main import app, lifespan
+t1 = time.perf_counter()
+async def ready():
+    async with lifespan(app):
+        return time.perf_counter()
+t2 = asyncio.run(ready())
+json.dump({"import_seconds": t1 - t0, "ready_seconds": t2 - t0}, sys.stdout)
+'''
+
+
+def startup_time(runs: int) -> dict:
+    # Fresh interpreters, like a new uvicorn worker; interpreter boot itself is excluded
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', _PROBE], cwd=backend, check=True, capture_output=True, text=True)
+        samples.append(json.loads(out.stdout))
+    result = {'runs': runs}
+    for key in ('import_seconds', 'ready_seconds'):
+        values = sorted(s[key] for s in samples)
+        result[key] = {'min': round(values[0], 4), 'median': round(values[len(values) // 2], 4),
+                       'max': round(values[-1], 4)}
+    return result
+
+
+def _time_kdf(algorithm: str, iterations: int, runs: int) -> float:
+    salt = os.urandom(16)
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        crypto.derive_key('calibration-password', salt, iterations, algorithm)
+        samples.append(time.perf_counter() - started)
+    return sorted(samples)[len(samples) // 2]
+
+
+def calibrate_kdf(target_ms: float, algorithm: str, runs: int, min_iterations: int) -> dict:
+    """Iteration count whose median verification on this CPU takes about target_ms.
+
+    PBKDF2 cost is linear in iterations, so a short probe is scaled up and the
+    result re-measured. Run it on the production hardware, on an idle machine.
+    """
+    probe = 20_000
+    per_iteration = _time_kdf(algorithm, probe, runs) / probe
+    while per_iteration * probe < 0.02:  # probe long enough to swamp timer noise
+        probe *= 4
+        per_iteration = _time_kdf(algorithm, probe, runs) / probe
+    iterations = int(target_ms / 1000 / per_iteration) // 1000 * 1000
+    clamped = iterations < min_iterations
+    iterations = max(iterations, min_iterations)
+    seconds = _time_kdf(algorithm, iterations, runs)
+    return {
+        'algorithm': algorithm,
+        'iterations': iterations,
+        'clamped_to_minimum': clamped,
+        'median_ms': round(seconds * 1000, 1),
+        # Each KDF worker verifies one password at a time
+        'logins_per_second': round(KDF_POOL_SIZE / seconds, 1),
+        'kdf_pool_size': KDF_POOL_SIZE,
+        'current': {'algorithm': KDF_ALGORITHM, 'iterations': KDF_ITERS},
+        'env': f'KDF_ALGORITHM={algorithm} KDF_ITERS={iterations}',
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.manage', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('migrate', help='create missing tables, columns and indexes')
+    probe = commands.add_parser('startup-time', help='measure import-to-ready time of a worker')
+    probe.add_argument('--runs', type=int, default=5)
+    calibrate = commands.add_parser('calibrate-kdf', help='pick KDF_ITERS for a target verification latency')
+    calibrate.add_argument('--target-ms', type=float, default=250.0)
+    calibrate.add_argument('--algorithm', choices=sorted(crypto.KDF_HASHES), default=KDF_ALGORITHM)
+    calibrate.add_argument('--runs', type=int, default=5, help='timed derivations per measurement')
+    calibrate.add_argument('--min-iterations', type=int, default=100_000, help='never suggest fewer')
+    args = parser.parse_args(argv)
+
+    if args.command == 'migrate':
+        started = time.perf_counter()
+        actions = asyncio.run(migrate())
+        for action in actions:
+            print(action)
+        print(f'schema up to date ({len(actions)} changes, {time.perf_counter() - started:.2f}s)')
+    elif args.command == 'startup-time':
+        print(json.dumps(startup_time(args.runs), indent=2))
+    elif args.command == 'calibrate-kdf':
+        print(json.dumps(calibrate_kdf(args.target_ms, args.algorithm, args.runs, args.min_iterations), indent=2))
+
+
+if __name__ == '__main__':
+    main()
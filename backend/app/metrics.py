@@ -0,0 +1,174 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Deliberately tiny: counters and fixed-bucket histograms keyed by label tuples,
+no client library. Every update is a dict lookup plus a bisect under a lock.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Sequence, Tuple
+
+from . import profiling
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 0.001, 0.0025, 0.005, 0.01)  # JWT, single statements
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _num(v: float) -> str:
+    return repr(float(v)) if v != int(v) else str(int(v))
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = ()):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.doc}'
+        yield f'# TYPE {self.name} counter'
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_num(value)}'
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, list] = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        pos = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            entry[pos] += 1
+            entry[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.doc}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for labels, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry):
+                cumulative += count
+                le = 'le="%s"' % ('+Inf' if bound == float('inf') else _num(bound))
+                yield f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {_num(entry[-1])}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for m in self._metrics for line in m.render()) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'http_requests_total', 'HTTP requests by route template, method and status.', ('method', 'route', 'status')))
+http_latency = registry.register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route template.', ('method', 'route')))
+http_db_time = registry.register(Histogram(
+    'http_request_db_seconds', 'Time spent in DB statements per HTTP request.', ('method', 'route')))
+db_statement = registry.register(Histogram(
+    'db_statement_duration_seconds', 'Duration of individual DB statements.', buckets=FAST_BUCKETS + LATENCY_BUCKETS[4:]))
+kdf_duration = registry.register(Histogram(
+    'kdf_duration_seconds', 'PBKDF2 compute time inside the KDF worker.', ('op',)))
+kdf_queue = registry.register(Histogram(
+    'kdf_queue_seconds', 'Time a KDF call waited for a free KDF worker.', ('op',)))
+kdf_rehash = registry.register(Counter(
+    'kdf_rehash_total', 'Password verifiers re-derived with the current KDF parameters on login.', ('result',)))
+jwt_duration = registry.register(Histogram(
+    'jwt_duration_seconds', 'JWT encode/decode (HS256) time.', ('op',), buckets=FAST_BUCKETS))
+auth_cache_lookups = registry.register(Counter(
+    'auth_cache_lookups_total', 'Auth cache lookups (user, jwt) by result.', ('cache', 'result')))
+login_throttled = registry.register(Counter(
+    'login_throttled_total', 'Password attempts rejected by the login rate limiter.', ('scope',)))
+
+http_db_statements = registry.register(Histogram(
+    'http_request_db_statements', 'DB statements issued per HTTP request.', ('method', 'route'),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100)))
+
+# DB time per request comes from the per-request QueryProfile (see profiling.py)
+profiling.statement_listeners.append(db_statement.observe)
+
+
+# --- HTTP middleware ---
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: per-route count/status/latency plus DB time and statement count.
+
+    Routes are labelled by their path template (/cards/{card_id}), never the raw
+    path, so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        status = 500
+        profile, token = profiling.start()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            profiling.finish(token)
+            route = scope.get('route')
+            template = getattr(route, 'path', None) or '<unmatched>'
+            method = scope['method']
+            http_requests.inc(method, template, str(status))
+            http_latency.observe(elapsed, method, template)
+            http_db_time.observe(profile.seconds, method, template)
+            http_db_statements.observe(profile.statements, method, template)
+            profiling.report_request(method, template, status, elapsed, profile)
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
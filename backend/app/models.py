@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, LargeBinary, DateTime, ForeignKey, Float, Date
+from sqlalchemy import DDL, Column, Integer, String, LargeBinary, DateTime, ForeignKey, Float, Date, Index, event, func
 from sqlalchemy.orm import relationship
 from .db import Base
 
@@ -9,10 +9,20 @@ class User(Base):
     username = Column(String, unique=True, index=True, nullable=False)
     password_salt = Column(LargeBinary, nullable=False)
     password_verifier = Column(LargeBinary, nullable=False)
+    # Parameters the verifier was derived with; NULL = legacy pbkdf2-sha256, 200k iterations
+    kdf_algorithm = Column(String(32), nullable=True)
+    kdf_iterations = Column(Integer, nullable=True)
+    # Bumped by every card/subscription write; drives ETags on the list/detail endpoints
+    data_version = Column(Integer, nullable=False, default=0, server_default='0')
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Tokens issued (iat) before this instant are rejected: logout everywhere / revoke-tokens
+    tokens_revoked_at = Column(DateTime, nullable=True)
     
-    cards = relationship('Card', back_populates='owner', cascade='all, delete-orphan')
-    subscriptions = relationship('Subscription', back_populates='owner', cascade='all, delete-orphan')
+    # Never lazy-loaded: an implicit per-row load is an N+1 (and fails under asyncio anyway)
+    cards = relationship('Card', back_populates='owner', cascade='all, delete-orphan',
+                         lazy='raise_on_sql', passive_deletes=True)
+    subscriptions = relationship('Subscription', back_populates='owner', cascade='all, delete-orphan',
+                                 lazy='raise_on_sql', passive_deletes=True)
 
 class Card(Base):
     __tablename__ = 'cards'
@@ -23,7 +33,17 @@ class Card(Base):
     nonce = Column(LargeBinary, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    owner = relationship('User', back_populates='cards')
+    owner = relationship('User', back_populates='cards', lazy='raise_on_sql')
+
+    # Keyset pagination of GET /cards: WHERE owner_id = ? AND id > ? ORDER BY id
+    __table_args__ = (
+        Index('ix_cards_owner_id_id', 'owner_id', 'id'),
+        # GET /search: trigram LIKE on Postgres, range/instr scans of the owner's labels on SQLite
+        # (fold() is the Unicode lower() registered in db.py)
+        Index('ix_cards_lower_label_trgm', func.lower(label).label('label_lower'),
+              postgresql_using='gin', postgresql_ops={'label_lower': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_cards_owner_id_fold_label', 'owner_id', func.fold(label)).ddl_if(dialect='sqlite'),
+    )
 
 class Subscription(Base):
     __tablename__ = 'subscriptions'
@@ -38,4 +58,33 @@ class Subscription(Base):
     notes = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    owner = relationship('User', back_populates='subscriptions')
\ No newline at end of file
+    owner = relationship('User', back_populates='subscriptions', lazy='raise_on_sql')
+
+    # Keyset pagination of GET /subscriptions, ordered by (next_billing_date, id);
+    # also the range scan behind GET /subscriptions/upcoming
+    __table_args__ = (
+        Index('ix_subscriptions_owner_id_next_billing_date_id', 'owner_id', 'next_billing_date', 'id'),
+        # Cross-user date range scan for reminder fan-out (/internal/subscriptions/upcoming)
+        Index('ix_subscriptions_next_billing_date_owner_id', 'next_billing_date', 'owner_id', 'id'),
+        # GET /search, same split as on cards
+        Index('ix_subscriptions_lower_service_name_trgm', func.lower(service_name).label('service_name_lower'),
+              postgresql_using='gin', postgresql_ops={'service_name_lower': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_subscriptions_owner_id_fold_service_name', 'owner_id', func.fold(service_name)).ddl_if(dialect='sqlite'),
+    )
+
+class RevokedToken(Base):
+    """A single revoked JWT (POST /logout), kept until the token would have expired anyway."""
+    __tablename__ = 'revoked_tokens'
+    token_hash = Column(LargeBinary(32), primary_key=True)  # sha256 of the encoded token
+    owner_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class AuthState(Base):
+    """Single row (id=1). revocation_version is bumped by every revocation; workers
+    poll it to drop their cached tokens/users (see auth.sync_revocations)."""
+    __tablename__ = 'auth_state'
+    id = Column(Integer, primary_key=True)
+    revocation_version = Column(Integer, nullable=False, default=0, server_default='0')
+
+# Trigram operator classes used by the search indexes above
+event.listen(Base.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""Per-request SQL profiling built on SQLAlchemy engine events.
+
+Every statement executed while a QueryProfile is active is counted and timed
+into it; the slowest statement is kept, and a statement repeated many times in
+one request (the usual N+1 shape) is flagged. MetricsMiddleware opens a profile
+per HTTP request and hands it to report_request(), which logs requests over the
+PROFILE_* thresholds.
+
+Profiles nest: assert_max_queries() in a test wraps a whole client call and
+still sees the statements that the middleware's inner profile records.
+
+    from app.profiling import assert_max_queries
+
+    with assert_max_queries(3):
+        r = await client.get('/cards', headers=auth)
+"""
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from .config import PROFILE_MAX_STATEMENTS, PROFILE_REPEAT_THRESHOLD, PROFILE_SLOW_REQUEST_MS
+
+log = logging.getLogger(__name__)
+
+
+class QueryProfile:
+    __slots__ = ('seconds', 'statements', 'slowest', 'slowest_seconds', 'repeats', 'log')
+
+    def __init__(self, keep_statements: bool = False):
+        self.seconds = 0.0
+        self.statements = 0
+        self.slowest: Optional[str] = None
+        self.slowest_seconds = 0.0
+        self.repeats = Counter()  # statement text -> executions
+        self.log: Optional[List[Tuple[str, float]]] = [] if keep_statements else None
+
+    def record(self, statement: str, seconds: float):
+        self.seconds += seconds
+        self.statements += 1
+        self.repeats[statement] += 1
+        if seconds > self.slowest_seconds:
+            self.slowest, self.slowest_seconds = statement, seconds
+        if self.log is not None:
+            self.log.append((statement, seconds))
+
+    def repeated(self, threshold: int = PROFILE_REPEAT_THRESHOLD) -> List[Tuple[str, int]]:
+        return [(s, n) for s, n in self.repeats.most_common() if n >= threshold]
+
+    def summary(self) -> dict:
+        return {
+            'statements': self.statements,
+            'db_ms': round(self.seconds * 1000, 3),
+            'slowest_ms': round(self.slowest_seconds * 1000, 3),
+            'slowest': self.slowest,
+        }
+
+
+_active: ContextVar[Tuple[QueryProfile, ...]] = ContextVar('query_profiles', default=())
+
+# Called with the duration of every statement, profiled or not (metrics histogram)
+statement_listeners: List[Callable[[float], None]] = []
+
+
+def start(profile: Optional[QueryProfile] = None):
+    """Activate a profile in the current context; returns (profile, token) for finish()."""
+    profile = profile or QueryProfile()
+    return profile, _active.set(_active.get() + (profile,))
+
+
+def finish(token):
+    _active.reset(token)
+
+
+def instrument_engine(sync_engine):
+    # The async engine runs these sync events in a greenlet that shares the
+    # request task's context, so _active resolves to the right request
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['_query_started'].pop()
+        for listener in statement_listeners:
+            listener(elapsed)
+        for profile in _active.get():
+            profile.record(statement, elapsed)
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def _error(context):
+        # Failed statements never reach after_cursor_execute
+        conn = context.connection
+        if conn is not None and conn.info.get('_query_started'):
+            conn.info['_query_started'].pop()
+
+
+def report_request(method: str, route: str, status: int, seconds: float, profile: QueryProfile):
+    """Log a request that went over the latency or statement budget, or looks like N+1."""
+    reasons = []
+    if PROFILE_SLOW_REQUEST_MS and seconds * 1000 >= PROFILE_SLOW_REQUEST_MS:
+        reasons.append('slow')
+    if PROFILE_MAX_STATEMENTS and profile.statements > PROFILE_MAX_STATEMENTS:
+        reasons.append('too many statements')
+    repeated = profile.repeated() if PROFILE_REPEAT_THRESHOLD else []
+    if repeated:
+        reasons.append('repeated statement')
+    if not reasons:
+        return
+    log.warning(
+        '%s %s %s (%s): %.1fms total, %d statements, %.1fms in DB, slowest %.1fms: %s%s',
+        method, route, status, ', '.join(reasons), seconds * 1000, profile.statements,
+        profile.seconds * 1000, profile.slowest_seconds * 1000, _short(profile.slowest),
+        ''.join(f'\n  x{n}: {_short(s)}' for s, n in repeated[:3]),
+    )
+
+
+def _short(statement: Optional[str], limit: int = 300) -> str:
+    text = ' '.join((statement or '').split())
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+@contextmanager
+def assert_max_queries(n: int):
+    """Fail if more than n statements run inside the block (test helper).
+
+    Yields the QueryProfile, which keeps every statement for the failure message.
+    """
+    profile, token = start(QueryProfile(keep_statements=True))
+    try:
+        yield profile
+    finally:
+        finish(token)
+    if profile.statements > n:
+        listing = '\n'.join(f'  {i}. ({sec * 1000:.2f}ms) {_short(s)}' for i, (s, sec) in enumerate(profile.log, 1))
+        raise AssertionError(f'Expected at most {n} statements, got {profile.statements}:\n{listing}')
@@ -0,0 +1,211 @@
+"""Token-bucket throttling for the password endpoints.
+
+Every /token attempt costs one PBKDF2 verification, so attempts are metered
+per client IP and per username *before* the user lookup and the KDF. A
+rejected attempt costs a dict lookup (or one Redis round trip) and is answered
+with 429 + Retry-After.
+
+A bucket holds up to `burst` tokens and refills at `rate` tokens per second;
+each attempt takes one. Buckets live in a bounded in-process LRU by default.
+With RATELIMIT_REDIS_URL set they live in Redis instead, so the limits hold
+across uvicorn workers; keys expire once their bucket would be full again.
+"""
+import ipaddress
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+from . import metrics
+from .config import (
+    LOGIN_IP_BURST, LOGIN_IP_EXEMPT, LOGIN_IP_RATE, LOGIN_USER_BURST, LOGIN_USER_RATE,
+    RATELIMIT_MAX_KEYS, RATELIMIT_REDIS_URL,
+)
+
+log = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    """Raised when a bucket is empty; mapped to 429 + Retry-After."""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Too many attempts ({scope})")
+        self.scope = scope
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class MemoryBuckets:
+    """Bounded LRU of key -> (tokens, updated_at, burst, rate) for a single process.
+
+    A bucket that has refilled completely carries no state, so those are
+    dropped first; past `maxsize` the least recently used bucket goes.
+    """
+
+    def __init__(self, maxsize: int = RATELIMIT_MAX_KEYS):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    async def take(self, key: str, burst: int, rate: float) -> float:
+        """Take one token; returns 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            tokens = burst if entry is None else min(burst, entry[0] + (now - entry[1]) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self._entries[key] = (tokens, now, burst, rate)
+            self._entries.move_to_end(key)
+            self._prune(now)
+            return wait
+
+    def _prune(self, now: float):
+        # Oldest-first: stop at the first bucket that still remembers something
+        while self._entries:
+            key, (tokens, updated, burst, rate) = next(iter(self._entries.items()))
+            if len(self._entries) > self.maxsize:
+                self.evictions += 1
+            elif tokens + (now - updated) * rate < burst:
+                break
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "keys": len(self._entries), "maxsize": self.maxsize,
+                    "evictions": self.evictions}
+
+    async def close(self):
+        pass
+
+
+# KEYS[1] = bucket, ARGV = burst, rate (tokens/s). Returns the wait in ms, 0 = allowed.
+_TAKE_SCRIPT = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+if tokens == nil then
+  tokens = burst
+else
+  tokens = math.min(burst, tokens + (now - tonumber(state[2])) * rate / 1000)
+end
+local wait = 0
+if tokens >= 1 then
+  tokens = tokens - 1
+else
+  wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) * 1000 / rate) + 1000)
+return wait
+"""
+
+
+class RedisBuckets:
+    """Buckets shared by every worker, updated atomically by a Lua script.
+
+    Uses the Redis clock, so workers on different hosts agree on refill. If
+    Redis is unreachable, attempts are let through (and counted in `errors`)
+    rather than locking everyone out; the KDF pool's own admission limit still
+    applies.
+    """
+
+    def __init__(self, url: str, prefix: str = "vault:ratelimit:"):
+        self.url = url
+        self.prefix = prefix
+        self._client = None
+        self._script = None
+        self.errors = 0
+
+    def _get_script(self):
+        if self._script is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("RATELIMIT_REDIS_URL is set but the redis package is not installed") from None
+            self._client = redis.from_url(self.url, socket_timeout=0.5, socket_connect_timeout=0.5)
+            self._script = self._client.register_script(_TAKE_SCRIPT)
+        return self._script
+
+    async def take(self, key: str, burst: int, rate: float) -> float:
+        script = self._get_script()
+        try:
+            wait_ms = await script(keys=[self.prefix + key], args=[burst, rate])
+        except Exception as e:  # redis.RedisError, OSError, timeouts
+            self.errors += 1
+            log.warning("Rate limit store unavailable, allowing attempt: %s", e)
+            return 0.0
+        return int(wait_ms) / 1000
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "prefix": self.prefix, "errors": self.errors}
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = self._script = None
+
+
+class LoginLimiter:
+    """Per-IP and per-username buckets for password attempts. A rate of 0 disables that scope."""
+
+    def __init__(self, store, ip_limit: Tuple[int, float] = (LOGIN_IP_BURST, LOGIN_IP_RATE),
+                 user_limit: Tuple[int, float] = (LOGIN_USER_BURST, LOGIN_USER_RATE),
+                 ip_exempt: Sequence[str] = LOGIN_IP_EXEMPT):
+        self.store = store
+        self.ip_limit = ip_limit
+        self.user_limit = user_limit
+        self.ip_exempt = [ipaddress.ip_network(n, strict=False) for n in ip_exempt]
+        self.allowed = 0
+        self.rejected = {"ip": 0, "user": 0}
+
+    async def _take(self, scope: str, key: str, limit: Tuple[int, float]):
+        burst, rate = limit
+        if rate <= 0 or burst <= 0:
+            return
+        wait = await self.store.take(f"{scope}:{key}", burst, rate)
+        if wait > 0:
+            self.rejected[scope] += 1
+            metrics.login_throttled.inc(scope)
+            raise RateLimited(scope, wait)
+
+    def _exempt(self, client_ip: str) -> bool:
+        if not self.ip_exempt:
+            return False
+        try:
+            addr = ipaddress.ip_address(client_ip)
+        except ValueError:
+            return False
+        return any(addr in net for net in self.ip_exempt)
+
+    async def check(self, client_ip: Optional[str], username: Optional[str] = None):
+        # IP first: a single client spraying usernames is stopped without
+        # draining the buckets of the accounts it targets
+        if client_ip and not self._exempt(client_ip):
+            await self._take("ip", client_ip, self.ip_limit)
+        if username:
+            await self._take("user", username[:256], self.user_limit)
+        self.allowed += 1
+
+    def stats(self) -> dict:
+        return {
+            "ip": {"burst": self.ip_limit[0], "rate": self.ip_limit[1], "exempt": [str(n) for n in self.ip_exempt]},
+            "user": {"burst": self.user_limit[0], "rate": self.user_limit[1]},
+            "allowed": self.allowed,
+            "rejected": dict(self.rejected),
+            "store": self.store.stats(),
+        }
+
+    async def close(self):
+        await self.store.close()
+
+
+limiter = LoginLimiter(RedisBuckets(RATELIMIT_REDIS_URL) if RATELIMIT_REDIS_URL else MemoryBuckets())
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import date
+from typing import Optional
+
+from sqlalchemy import bindparam, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import billing, models
+from .config import ROLLOVER_BATCH_SIZE, ROLLOVER_INTERVAL
+from .db import SessionLocal
+
+log = logging.getLogger(__name__)
+
+Sub = models.Subscription
+# Walk order matches ix_subscriptions_next_billing_date_owner_id, so batches need no sort
+_KEY = (Sub.next_billing_date, Sub.owner_id, Sub.id)
+
+# One executemany per batch; the old date in the WHERE makes a row that another
+# worker already advanced a no-op instead of a double step
+_advance = (
+    update(Sub.__table__)
+    .where(Sub.__table__.c.id == bindparam('b_id'), Sub.__table__.c.next_billing_date == bindparam('b_old'))
+    .values(next_billing_date=bindparam('b_new'))
+)
+
+
+async def _rollover_batch(db: AsyncSession, today: date, batch_size: int, after: Optional[tuple]):
+    """Advance one batch of overdue subscriptions; returns (rows_seen, rows_updated, skipped, last_key)."""
+    stmt = (
+        select(Sub.id, Sub.owner_id, Sub.next_billing_date, Sub.billing_cycle, Sub.start_date)
+        .where(Sub.next_billing_date < today)
+        .order_by(*_KEY)
+        .limit(batch_size)
+    )
+    if after is not None:
+        # Rows skipped earlier in this run (unknown cycle) must not be fetched again
+        stmt = stmt.where(tuple_(*_KEY) > tuple_(*after))
+    if db.bind.dialect.name == 'postgresql':
+        # Concurrent workers take disjoint batches instead of queueing on each other's locks
+        stmt = stmt.with_for_update(skip_locked=True, of=Sub)
+    rows = (await db.execute(stmt)).all()
+    if not rows:
+        return 0, 0, 0, None
+
+    params, owners, skipped = [], set(), 0
+    for r in rows:
+        cycle = billing.parse_cycle(r.billing_cycle)
+        if cycle is None:
+            skipped += 1
+            continue
+        anchor = r.start_date.day if r.start_date else None
+        try:
+            new_date = billing.next_due(r.next_billing_date, cycle, today, anchor)
+        except (ValueError, OverflowError):
+            # Past date.max: skip the row rather than lose (and keep retrying) the whole batch
+            skipped += 1
+            continue
+        params.append({'b_id': r.id, 'b_old': r.next_billing_date, 'b_new': new_date})
+        owners.add(r.owner_id)
+
+    updated = 0
+    if params:
+        result = await db.execute(_advance, params)
+        updated = result.rowcount if result.rowcount >= 0 else len(params)
+        await db.execute(
+            update(models.User)
+            .where(models.User.id.in_(owners))
+            .values(data_version=models.User.data_version + 1)
+            .execution_options(synchronize_session=False)
+        )
+    await db.commit()
+    last = rows[-1]
+    return len(rows), updated, skipped, (last.next_billing_date, last.owner_id, last.id)
+
+
+class RolloverJob:
+    """Periodically moves stale next_billing_date values forward by whole billing cycles.
+
+    Works in batches of `batch_size`, one transaction each, so locks stay short and
+    a crash loses at most one batch. Safe to run from several workers at once.
+    """
+
+    def __init__(self, interval: float = ROLLOVER_INTERVAL, batch_size: int = ROLLOVER_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.runs = 0
+        self.rows_updated = 0
+        self.last_run: Optional[dict] = None
+        self.last_error: Optional[str] = None
+
+    async def run_once(self, today: Optional[date] = None) -> dict:
+        today = today or date.today()
+        async with self._lock:
+            started = time.perf_counter()
+            seen = updated = skipped = batches = 0
+            after = None
+            while True:
+                async with SessionLocal() as db:
+                    n, u, s, after = await _rollover_batch(db, today, self.batch_size, after)
+                if not n:
+                    break
+                batches += 1
+                seen += n
+                updated += u
+                skipped += s
+                if n < self.batch_size:
+                    break
+            elapsed = time.perf_counter() - started
+            self.runs += 1
+            self.rows_updated += updated
+            self.last_run = {
+                'today': today.isoformat(),
+                'batches': batches,
+                'rows_seen': seen,
+                'rows_updated': updated,
+                'skipped_unknown_cycle': skipped,
+                'seconds': round(elapsed, 4),
+                'rows_per_sec': round(updated / elapsed, 1) if elapsed else 0.0,
+            }
+            return self.last_run
+
+    def _delay(self) -> float:
+        # Up to 10% jitter so workers started together don't scan in lockstep
+        return self.interval * random.uniform(1.0, 1.1)
+
+    async def _loop(self):
+        # Sleep first: a freshly booted worker must not touch the database
+        # (POST /internal/jobs/rollover runs a pass on demand)
+        while True:
+            await asyncio.sleep(self._delay())
+            try:
+                result = await self.run_once()
+                if result['rows_updated']:
+                    log.info('Billing rollover: %s', result)
+                self.last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception('Billing rollover failed')
+                self.last_error = repr(e)
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._loop(), name='billing-rollover')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            'interval': self.interval,
+            'batch_size': self.batch_size,
+            'running': self._task is not None,
+            'busy': self._lock.locked(),
+            'runs': self.runs,
+            'rows_updated': self.rows_updated,
+            'last_run': self.last_run,
+            'last_error': self.last_error,
+        }
+
+
+job = RolloverJob()
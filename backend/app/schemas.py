@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime, date
 
 # --- Token ---
@@ -47,6 +47,12 @@ class RawCardIn(BaseModel):
     enc_data_b64: str
     nonce_b64: str
 
+# Same card with raw bytes, as sent in application/msgpack bodies
+class RawCardBinIn(BaseModel):
+    label: Optional[str] = None
+    enc_data: bytes
+    nonce: bytes
+
 class RawCardOut(BaseModel):
     id: int
     label: Optional[str]
@@ -55,6 +61,14 @@ class RawCardOut(BaseModel):
     created_at: datetime
     class Config: orm_mode = True
 
+class RawCardBatchError(BaseModel):
+    index: int
+    detail: str
+
+class RawCardBatchOut(BaseModel):
+    created: List[RawCardOut]
+    errors: List[RawCardBatchError] = []
+
 # --- Subscription ---
 class SubscriptionBase(BaseModel):
     service_name: str
@@ -68,7 +82,92 @@ class SubscriptionBase(BaseModel):
 class SubscriptionCreate(SubscriptionBase):
     pass
 
+class SubscriptionImportError(BaseModel):
+    line: int
+    detail: str
+
+class SubscriptionImportOut(BaseModel):
+    accepted: int
+    rejected: int
+    errors: List[SubscriptionImportError]
+
 class SubscriptionOut(SubscriptionBase):
     id: int
     created_at: datetime
-    class Config: orm_mode = True
\ No newline at end of file
+    class Config: orm_mode = True
+
+class UpcomingBillingOut(BaseModel):
+    id: int
+    service_name: str
+    cost: float
+    currency: str
+    next_billing_date: date
+
+class UpcomingBillingAllOut(UpcomingBillingOut):
+    owner_id: int
+    username: str
+
+class SubscriptionListOut(SubscriptionOut):
+    # Present only when ?currency= is given
+    converted_cost: Optional[float] = None
+    converted_currency: Optional[str] = None
+
+# --- Search ---
+class SearchOut(BaseModel):
+    subscriptions: List[SubscriptionOut]
+    cards: List[RawCardOut]
+
+# --- Forecast ---
+class ForecastCharge(BaseModel):
+    id: int
+    service_name: str
+    date: date
+    amount: float
+    currency: str
+
+class ForecastMonth(BaseModel):
+    month: str  # YYYY-MM
+    totals: Dict[str, float]
+    charges: Optional[List[ForecastCharge]] = None
+    converted_total: Optional[float] = None
+
+class ForecastOut(BaseModel):
+    start: date
+    end: date
+    months: List[ForecastMonth]
+    unscheduled: int
+    unrecognized_cycles: List[str]
+    currency: Optional[str] = None
+    unconverted_currencies: List[str] = []
+
+# --- Analytics ---
+class SpendTotal(BaseModel):
+    currency: str
+    count: int
+    monthly: float
+    yearly: float
+
+class SpendByCycle(SpendTotal):
+    billing_cycle: str
+
+class TopService(BaseModel):
+    id: int
+    owner_id: int
+    service_name: str
+    cost: float
+    currency: str
+    billing_cycle: str
+    monthly_cost: float
+
+class SpendConverted(BaseModel):
+    currency: str
+    monthly: float
+    yearly: float
+    unconverted_currencies: List[str]
+
+class SpendAnalyticsOut(BaseModel):
+    totals: List[SpendTotal]
+    by_cycle: List[SpendByCycle]
+    top: List[TopService]
+    unrecognized_cycles: List[str]
+    converted: Optional[SpendConverted] = None
@@ -0,0 +1,69 @@
+import base64
+from datetime import date, datetime
+from typing import Any, Optional
+
+import msgpack
+import orjson
+from fastapi import Request, Response
+
+# Binary card transport: msgpack carries enc_data/nonce as raw bin fields instead
+# of base64 strings. JSON stays the default; clients opt in via Accept/Content-Type.
+MSGPACK = 'application/msgpack'
+MSGPACK_TYPES = (MSGPACK, 'application/x-msgpack', 'application/vnd.msgpack')
+
+
+def _media_types(header: Optional[str]):
+    for part in (header or '').split(','):
+        yield part.split(';', 1)[0].strip().lower()
+
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    return next(_media_types(content_type), '') in MSGPACK_TYPES
+
+
+def wants_msgpack(request: Request) -> bool:
+    return any(t in MSGPACK_TYPES for t in _media_types(request.headers.get('accept')))
+
+
+def _msgpack_default(o: Any):
+    if isinstance(o, (date, datetime)):
+        return o.isoformat()
+    raise TypeError(f'{type(o).__name__} is not msgpack serializable')
+
+
+def packb(obj: Any) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True, default=_msgpack_default)
+
+
+def unpackb(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+def msgpack_response(obj: Any, status_code: int = 200, headers: Optional[dict] = None) -> Response:
+    return Response(packb(obj), status_code=status_code, media_type=MSGPACK, headers=headers)
+
+
+# --- Fast JSON path for list endpoints ---
+# Rows go straight from column tuples to orjson; no per-row Pydantic model and no
+# second validation pass against response_model.
+
+def json_response(content: Any, headers: Optional[dict] = None) -> Response:
+    return Response(orjson.dumps(content), media_type='application/json', headers=headers)
+
+
+def card_json(row) -> dict:
+    return {
+        'id': row.id,
+        'label': row.label,
+        'enc_data_b64': base64.b64encode(row.enc_data).decode('ascii'),
+        'nonce_b64': base64.b64encode(row.nonce).decode('ascii'),
+        'created_at': row.created_at,
+    }
+
+
+def sub_json(row) -> dict:
+    return row._asdict()
+
+
+def card_record(id: int, label: Optional[str], enc_data: bytes, nonce: bytes, created_at: datetime) -> dict:
+    return {'id': id, 'label': label, 'enc_data': enc_data, 'nonce': nonce, 'created_at': created_at}
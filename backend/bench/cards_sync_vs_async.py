@@ -0,0 +1,163 @@
+"""Requests/sec for GET /cards: the old sync Session path vs the async app.
+
+Both servers run under uvicorn against the same seeded database, so the only
+difference is sync-def-in-threadpool vs async-def-on-asyncpg/aiosqlite.
+
+    cd backend
+    python bench/cards_sync_vs_async.py --cards 100 --concurrency 64 --duration 10
+    DATABASE_URL=postgresql://user:pw@localhost/bench python bench/cards_sync_vs_async.py
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_sync_app():
+    # Mirror of the pre-async GET /cards: sync engine, plain def, threadpool-bound
+    import jwt
+    from fastapi import Depends, FastAPI, HTTPException
+    from fastapi.security import OAuth2PasswordBearer
+    from sqlalchemy import create_engine
+    from sqlalchemy.engine import make_url
+    from sqlalchemy.orm import Session, sessionmaker
+    from app import models, schemas
+    from app.config import ALGORITHM, DATABASE_URL, SECRET_KEY
+    from app.db import register_sqlite_functions
+
+    url = make_url(DATABASE_URL)
+    if url.get_backend_name() == "postgresql":
+        url = url.set(drivername="postgresql+psycopg2")
+    engine = create_engine(url)
+    if url.get_backend_name() == "sqlite":
+        register_sqlite_functions(engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+        try:
+            username = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["sub"]
+        except jwt.PyJWTError:
+            raise HTTPException(status_code=401)
+        user = db.query(models.User).filter(models.User.username == username).first()
+        if user is None:
+            raise HTTPException(status_code=401)
+        return user
+
+    app = FastAPI()
+
+    @app.get("/cards", response_model=list[schemas.RawCardOut])
+    def list_cards(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+        cards = db.query(models.Card).filter(models.Card.owner_id == current_user.id).all()
+        return [
+            schemas.RawCardOut(
+                id=c.id, label=c.label,
+                enc_data_b64=base64.b64encode(c.enc_data).decode("ascii"),
+                nonce_b64=base64.b64encode(c.nonce).decode("ascii"),
+                created_at=c.created_at,
+            ) for c in cards
+        ]
+
+    return app
+
+
+def serve(target: str, port: int):
+    import uvicorn
+    if target == "sync":
+        uvicorn.run(build_sync_app(), port=port, log_level="warning")
+    else:
+        uvicorn.run("app.main:app", port=port, log_level="warning")
+
+
+async def seed(n_cards: int) -> str:
+    from app import auth, models
+    from app.db import SessionLocal, dispose_engine, get_engine
+
+    async with get_engine().begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await conn.run_sync(models.Base.metadata.create_all)
+    async with SessionLocal() as db:
+        # Dummy verifier: the benchmark never logs in, it mints the token directly
+        user = models.User(username="bench", password_salt=b"s" * 16, password_verifier=b"v" * 32)
+        db.add(user)
+        await db.flush()
+        db.add_all(
+            models.Card(owner_id=user.id, label=f"card {i}", enc_data=os.urandom(96), nonce=os.urandom(12))
+            for i in range(n_cards)
+        )
+        await db.commit()
+    await dispose_engine()
+    return auth.create_access_token({"sub": "bench"})
+
+
+async def load(port: int, token: str, concurrency: int, duration: float) -> dict:
+    import httpx
+
+    headers = {"Authorization": f"Bearer {token}"}
+    done = errors = 0
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", headers=headers, limits=limits) as client:
+        for _ in range(50):  # wait for uvicorn
+            try:
+                await client.get("/cards")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal done, errors
+            while time.perf_counter() < deadline:
+                r = await client.get("/cards")
+                if r.status_code == 200:
+                    done += 1
+                else:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {"requests": done, "errors": errors, "rps": round(done / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cards", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+    os.environ.setdefault("SECRET_KEY", "bench-secret-key-bench-secret-key")
+    token = asyncio.run(seed(args.cards))
+
+    results = {"cards": args.cards, "concurrency": args.concurrency, "duration": args.duration}
+    for i, target in enumerate(("sync", "async")):
+        port = args.port + i
+        proc = multiprocessing.get_context("spawn").Process(target=serve, args=(target, port), daemon=True)
+        proc.start()
+        try:
+            results[target] = asyncio.run(load(port, token, args.concurrency, args.duration))
+        finally:
+            proc.terminate()
+            proc.join()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Schedule expansion cost behind GET /subscriptions/forecast.
+
+"loop" expands each subscription in Python with billing.next_due/add_months, the
+straightforward per-subscription implementation. "vectorized" is
+forecast.expand_schedules. Both get the same synthetic portfolio (mixed monthly,
+yearly, quarterly, weekly and N-day cycles, some dates stale) and must produce
+identical charge lists. No database is involved.
+
+    cd backend
+    python bench/forecast.py --subs 100000 --months 36
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import numpy as np
+
+from app import billing, forecast
+
+CYCLES = ["monthly", "monthly", "monthly", "yearly", "quarterly", "weekly", "every 30 days", "biweekly"]
+
+
+def make_portfolio(n: int, today: date, seed: int = 0):
+    rnd = random.Random(seed)
+    subs = []
+    for _ in range(n):
+        cycle = billing.parse_cycle(rnd.choice(CYCLES))
+        start = today - timedelta(days=rnd.randint(0, 3 * 365))
+        # A quarter of the rows are stale (before today), the rest up to a year ahead
+        first = today + timedelta(days=rnd.randint(-400, -1) if rnd.random() < 0.25 else rnd.randint(0, 365))
+        subs.append((first, cycle, start.day))
+    return subs
+
+
+def expand_loop(subs, start: date, end: date):
+    out = []
+    for i, (first, cycle, anchor) in enumerate(subs):
+        current = billing.next_due(first, cycle, start, anchor)
+        k = 0
+        while True:
+            if cycle.days:
+                due = current + timedelta(days=k * cycle.days)
+            elif k:
+                due = billing.add_months(current, k * cycle.months, anchor)
+            else:
+                due = current
+            if due >= end:
+                break
+            out.append((due, i))
+            k += 1
+    out.sort()
+    return out
+
+
+def expand_vectorized(arrays, start: date, end: date):
+    idx, dates = forecast.expand_schedules(*arrays, np.datetime64(start, "D"), np.datetime64(end, "D"))
+    return idx, dates
+
+
+def to_arrays(subs):
+    first, cycles, anchor = zip(*subs)
+    return (
+        np.array(first, dtype="datetime64[D]"),
+        np.array([c.months for c in cycles], dtype=np.int64),
+        np.array([c.days for c in cycles], dtype=np.int64),
+        np.array(anchor, dtype=np.int64),
+    )
+
+
+def timeit(fn, *args, repeat: int):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--subs", type=int, nargs="+", default=[100000])
+    parser.add_argument("--months", type=int, default=36)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    today = date(2026, 1, 15)
+    end = billing.add_months(today, args.months)
+    results = []
+    for n in args.subs:
+        subs = make_portfolio(n, today)
+        arrays = to_arrays(subs)
+        t_loop, expected = timeit(expand_loop, subs, today, end, repeat=1)
+        t_vec, (idx, dates) = timeit(expand_vectorized, arrays, today, end, repeat=args.repeat)
+        assert list(zip(dates.tolist(), idx.tolist())) == expected
+        results.append({
+            "subscriptions": n,
+            "months": args.months,
+            "charges": len(expected),
+            "loop_s": round(t_loop, 3),
+            "vectorized_s": round(t_vec, 3),
+            "speedup": round(t_loop / t_vec, 1),
+        })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
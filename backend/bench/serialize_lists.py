@@ -0,0 +1,127 @@
+"""Per-row serialization cost of GET /cards and GET /subscriptions bodies.
+
+"before" replays what the endpoints used to do per request: build a Pydantic
+model per row (cards explicitly, subscriptions via orm_mode from ORM objects),
+re-validate the list against response_model, jsonable_encoder, stdlib json.
+"after" is the current path: column Row tuples -> dicts -> orjson.
+No database is involved; rows are built in memory so only serialization is timed.
+
+    cd backend
+    python bench/serialize_lists.py --rows 1000 10000
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import parse_obj_as
+from sqlalchemy import create_engine, select
+
+from app import crud, models, schemas, serialization
+from app.db import register_sqlite_functions
+
+
+def make_rows(n: int):
+    # Real SQLAlchemy Row objects for the new path, ORM instances for the old one
+    engine = create_engine("sqlite://")
+    register_sqlite_functions(engine)  # the fold() expression indexes need it
+    models.Base.metadata.create_all(engine)
+    now = datetime(2026, 1, 1)
+    with engine.begin() as conn:
+        conn.execute(models.User.__table__.insert(), [{"id": 1, "username": "b", "password_salt": b"s", "password_verifier": b"v"}])
+        conn.execute(models.Card.__table__.insert(), [
+            {"owner_id": 1, "label": f"card {i}", "enc_data": os.urandom(96), "nonce": os.urandom(12), "created_at": now}
+            for i in range(n)
+        ])
+        conn.execute(models.Subscription.__table__.insert(), [
+            {"owner_id": 1, "service_name": f"svc {i}", "cost": 9.99, "currency": "USD", "billing_cycle": "monthly",
+             "next_billing_date": date(2026, 1, 1) + timedelta(days=i % 365), "start_date": date(2025, 1, 1),
+             "notes": None, "created_at": now}
+            for i in range(n)
+        ])
+        card_rows = conn.execute(select(*crud.CARD_LIST_COLUMNS)).all()
+        sub_rows = conn.execute(select(*crud.SUB_LIST_COLUMNS)).all()
+    sub_objs = [models.Subscription(**r._asdict(), owner_id=1) for r in sub_rows]
+    return card_rows, sub_rows, sub_objs
+
+
+def _from_orm(model, obj):
+    # orm_mode on Pydantic 1, from_attributes on Pydantic 2 (what FastAPI does for response_model)
+    if hasattr(model, "model_validate"):
+        return model.model_validate(obj, from_attributes=True)
+    return model.from_orm(obj)
+
+
+def cards_before(rows):
+    out = [
+        schemas.RawCardOut(
+            id=c.id, label=c.label,
+            enc_data_b64=base64.b64encode(c.enc_data).decode("ascii"),
+            nonce_b64=base64.b64encode(c.nonce).decode("ascii"),
+            created_at=c.created_at,
+        ) for c in rows
+    ]
+    out = parse_obj_as(List[schemas.RawCardOut], out)
+    return json.dumps(jsonable_encoder(out)).encode()
+
+
+def cards_after(rows):
+    return serialization.json_response([serialization.card_json(c) for c in rows]).body
+
+
+def subs_before(objs):
+    out = [_from_orm(schemas.SubscriptionOut, o) for o in objs]
+    out = parse_obj_as(List[schemas.SubscriptionOut], out)
+    return json.dumps(jsonable_encoder(out)).encode()
+
+
+def subs_after(rows):
+    return serialization.json_response([serialization.sub_json(s) for s in rows]).body
+
+
+def timeit(fn, arg, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    for n in args.rows:
+        card_rows, sub_rows, sub_objs = make_rows(n)
+        assert json.loads(cards_before(card_rows)) == json.loads(cards_after(card_rows))
+        assert json.loads(subs_before(sub_objs)) == json.loads(subs_after(sub_rows))
+        for name, before, after, before_arg, after_arg in (
+            ("cards", cards_before, cards_after, card_rows, card_rows),
+            ("subscriptions", subs_before, subs_after, sub_objs, sub_rows),
+        ):
+            t_before = timeit(before, before_arg, args.repeat)
+            t_after = timeit(after, after_arg, args.repeat)
+            results.append({
+                "list": name,
+                "rows": n,
+                "before_us_per_row": round(t_before / n * 1e6, 3),
+                "after_us_per_row": round(t_after / n * 1e6, 3),
+                "speedup": round(t_before / t_after, 1),
+            })
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
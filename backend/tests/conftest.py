@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# config.py reads the environment once at import, so this runs before any app import
+_tmp = tempfile.mkdtemp(prefix='vault-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ.setdefault('SECRET_KEY', 'test-secret-key-test-secret-key-0')
+os.environ['KDF_POOL_KIND'] = 'thread'
+os.environ['KDF_ITERS'] = '1000'
+os.environ['ROLLOVER_INTERVAL'] = '0'
+# The revocation version is read once, by the first request; later counts stay exact
+os.environ['AUTH_REVOCATION_CHECK'] = '3600'
+os.environ['LOGIN_IP_RATE'] = '0'
+os.environ['LOGIN_USER_RATE'] = '0'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
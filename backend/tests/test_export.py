@@ -0,0 +1,25 @@
+"""The all-users export must carry everything a login needs after a restore."""
+import asyncio
+import uuid
+from datetime import datetime
+
+from app import crud, models
+from app.db import SessionLocal
+from app.manage import migrate
+
+
+def test_user_record_has_kdf_params():
+    async def main():
+        await migrate()
+        revoked = datetime(2026, 1, 2, 3, 4, 5)
+        async with SessionLocal() as db:
+            user = models.User(username=f'u-{uuid.uuid4().hex}', password_salt=b's', password_verifier=b'v',
+                               kdf_algorithm='pbkdf2-sha512', kdf_iterations=123_456, tokens_revoked_at=revoked)
+            db.add(user)
+            await db.commit()
+            records = [r async for r in crud.iter_vault(db) if r['type'] == 'user' and r['id'] == user.id]
+        assert len(records) == 1
+        assert records[0]['kdf_algorithm'] == 'pbkdf2-sha512'
+        assert records[0]['kdf_iterations'] == 123_456
+        assert records[0]['tokens_revoked_at'] == revoked
+    asyncio.run(main())
@@ -0,0 +1,34 @@
+"""Forecast must report absurd billing cycles instead of overflowing."""
+import asyncio
+import uuid
+from datetime import date, timedelta
+
+import httpx
+
+from app.main import app, lifespan
+from app.manage import migrate
+
+CYCLES = ['99999999999999999999 days', '9999 years', '36600 days', '100 years', 'monthly']
+
+
+def test_huge_cycles_are_unrecognized():
+    async def main():
+        await migrate()
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+                r = await client.post('/register', json={'username': f'u-{uuid.uuid4().hex}', 'password': 'pw'})
+                assert r.status_code == 200, r.text
+                headers = {'Authorization': f"Bearer {r.json()['access_token']}"}
+                start = (date.today() + timedelta(days=1)).isoformat()
+                for cycle in CYCLES:
+                    r = await client.post('/subscriptions', headers=headers, json={
+                        'service_name': cycle, 'cost': 1, 'billing_cycle': cycle, 'next_billing_date': start})
+                    assert r.status_code == 200, r.text
+
+                r = await client.get('/subscriptions/forecast', params={'months': 12}, headers=headers)
+                assert r.status_code == 200, r.text
+                body = r.json()
+                assert set(body['unrecognized_cycles']) == {'99999999999999999999 days', '9999 years'}
+                assert sum(len(m['charges']) for m in body['months']) == 2 + 12
+    asyncio.run(main())
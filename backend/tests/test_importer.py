@@ -0,0 +1,33 @@
+"""Line splitting of uploaded CSV/NDJSON files."""
+import io
+import time
+
+import pytest
+
+from app import importer
+
+
+def _lines(data: bytes):
+    return list(importer._iter_text_lines(io.BytesIO(data)))
+
+
+def test_line_breaks_across_reads():
+    data = b'a' * (importer.READ_SIZE - 1) + b'\r\nb\rc\n\xe2\x80\xa8d'
+    assert _lines(data) == ['a' * (importer.READ_SIZE - 1) + '\r\n', 'b\r', 'c\n', '\u2028d']
+
+
+def test_long_line_is_rejected(monkeypatch):
+    monkeypatch.setattr(importer, 'IMPORT_MAX_LINE', 4 * importer.READ_SIZE)
+    data = b'{"service_name": "ok", "cost": 1}\n' + b'x' * (16 * importer.READ_SIZE)
+    lines = importer._iter_text_lines(io.BytesIO(data))
+    assert next(lines).startswith('{')
+    with pytest.raises(importer.LineTooLong):
+        next(lines)
+
+
+def test_unterminated_line_scan_is_linear():
+    # Rescanning the whole buffer per read made this quadratic
+    data = b'x' * (importer.IMPORT_MAX_LINE - 1)
+    started = time.perf_counter()
+    assert _lines(data) == [data.decode()]
+    assert time.perf_counter() - started < 1
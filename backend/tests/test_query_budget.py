@@ -0,0 +1,132 @@
+"""Statement budgets for the hot list endpoints (N+1 guard).
+
+A warm request (token and user already cached) costs the data_version lookup
+for the ETag plus one page query, however many rows the page holds.
+"""
+import asyncio
+import base64
+import uuid
+from datetime import date
+
+import httpx
+from sqlalchemy import select, tuple_
+
+from app import auth, crud, models
+from app.db import SessionLocal
+from app.main import app, lifespan
+from app.manage import migrate
+from app.profiling import assert_max_queries
+
+ROWS = 50
+WARM_BUDGET = 2  # data_version + page
+COLD_BUDGET = 4  # + revoked-token lookup + user load
+SUBS_TAIL = 1  # /subscriptions reads undated rows separately once the dated ones run out
+
+
+def run(scenario):
+    async def main():
+        await migrate()
+        async with lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+                r = await client.post('/register', json={'username': f'u-{uuid.uuid4().hex}', 'password': 'pw'})
+                assert r.status_code == 200, r.text
+                headers = {'Authorization': f"Bearer {r.json()['access_token']}"}
+                await scenario(client, headers)
+    asyncio.run(main())
+
+
+async def _add_cards(client, headers, n):
+    blob = base64.b64encode(b'\0' * 16).decode()
+    items = [{'label': f'card {i}', 'enc_data_b64': blob, 'nonce_b64': blob} for i in range(n)]
+    r = await client.post('/cards/batch', json=items, headers=headers)
+    assert r.status_code == 200, r.text
+
+
+async def _add_subs(client, headers, n):
+    for i in range(n):
+        r = await client.post('/subscriptions', json={'service_name': f'service {i}', 'cost': 1}, headers=headers)
+        assert r.status_code == 200, r.text
+
+
+def test_list_cards_budget():
+    async def scenario(client, headers):
+        await _add_cards(client, headers, ROWS)
+        with assert_max_queries(WARM_BUDGET):
+            r = await client.get('/cards', headers=headers)
+        assert r.status_code == 200
+        assert len(r.json()) == ROWS
+    run(scenario)
+
+
+def test_list_subscriptions_budget():
+    async def scenario(client, headers):
+        await _add_subs(client, headers, ROWS)
+        with assert_max_queries(WARM_BUDGET + SUBS_TAIL):
+            r = await client.get('/subscriptions', headers=headers)
+        assert r.status_code == 200
+        assert len(r.json()) == ROWS
+    run(scenario)
+
+
+def test_list_budget_does_not_grow_with_rows():
+    async def scenario(client, headers):
+        counts = []
+        for _ in range(2):
+            await _add_cards(client, headers, ROWS)
+            await _add_subs(client, headers, 5)
+            with assert_max_queries(WARM_BUDGET * 2 + SUBS_TAIL) as profile:
+                assert (await client.get('/cards', headers=headers)).status_code == 200
+                assert (await client.get('/subscriptions', headers=headers)).status_code == 200
+            counts.append(profile.statements)
+        assert counts[0] == counts[1]
+    run(scenario)
+
+
+def test_cold_auth_budget():
+    async def scenario(client, headers):
+        await _add_cards(client, headers, ROWS)
+        await _add_subs(client, headers, 5)
+        for url, budget in (('/cards', COLD_BUDGET), ('/subscriptions', COLD_BUDGET + SUBS_TAIL)):
+            auth.token_cache.invalidate()
+            auth.user_cache.invalidate()
+            with assert_max_queries(budget):
+                assert (await client.get(url, headers=headers)).status_code == 200
+    run(scenario)
+
+
+def test_subscription_pages_are_index_range_scans():
+    async def scenario(client, headers):
+        dates = [None, '2030-01-03', None, '2030-01-01', '2030-01-03', None, '2030-01-02']
+        for i, d in enumerate(dates):
+            r = await client.post('/subscriptions', headers=headers,
+                                  json={'service_name': f'service {i}', 'cost': 1, 'next_billing_date': d})
+            assert r.status_code == 200, r.text
+        expected = [s['id'] for s in (await client.get('/subscriptions', headers=headers)).json()]
+        seen, cursor = [], None
+        while True:
+            r = await client.get('/subscriptions', headers=headers,
+                                 params={'limit': 2, **({'cursor': cursor} if cursor else {})})
+            assert r.status_code == 200, r.text
+            seen += [s['id'] for s in r.json()]
+            cursor = r.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+        assert seen == expected
+        body = (await client.get('/subscriptions', headers=headers)).json()
+        keys = [(s['next_billing_date'] or '9999', s['id']) for s in body]
+        assert keys == sorted(keys) and body[-1]['next_billing_date'] is None
+
+        async with SessionLocal() as db:
+            stmt = select(*crud.SUB_LIST_COLUMNS).where(
+                models.Subscription.owner_id == 1, models.Subscription.next_billing_date.is_not(None),
+                tuple_(models.Subscription.next_billing_date, models.Subscription.id) > tuple_(date(2030, 1, 1), 1),
+            ).order_by(models.Subscription.next_billing_date, models.Subscription.id)
+            compiled = stmt.compile(db.bind)
+            params = tuple(str(compiled.params[k]) for k in compiled.positiontup)
+            conn = await db.connection()
+            plan = ' '.join(r[-1] for r in (await conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params)).all())
+        assert '(owner_id=? AND next_billing_date>?)' in plan, plan
+        assert 'TEMP B-TREE' not in plan, plan
+    run(scenario)
+
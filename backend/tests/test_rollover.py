@@ -0,0 +1,47 @@
+"""Billing rollover must survive rows whose cycle can't be advanced."""
+import asyncio
+import uuid
+from datetime import date
+
+from app import billing, models, rollover
+from app.db import SessionLocal
+from app.manage import migrate
+
+
+def test_parse_cycle_bounds():
+    assert billing.parse_cycle('100 years') == billing.Cycle(months=1200, days=0)
+    assert billing.parse_cycle('36600 days') == billing.Cycle(months=0, days=36_600)
+    assert billing.parse_cycle('9999 years') is None
+    assert billing.parse_cycle('36601 days') is None
+    assert billing.parse_cycle('99999999999999999999 days') is None
+
+
+def test_rollover_skips_rows_past_date_max():
+    async def main():
+        await migrate()
+        async with SessionLocal() as db:
+            bad = models.User(username=f'u-{uuid.uuid4().hex}', password_salt=b'', password_verifier=b'')
+            good = models.User(username=f'u-{uuid.uuid4().hex}', password_salt=b'', password_verifier=b'')
+            db.add_all([bad, good])
+            await db.flush()
+            rows = [
+                models.Subscription(owner_id=bad.id, service_name='huge', cost=1,
+                                    billing_cycle='9999 years', next_billing_date=date(2020, 1, 1)),
+                models.Subscription(owner_id=bad.id, service_name='overflow', cost=1,
+                                    billing_cycle='100 years', next_billing_date=date(9990, 1, 1)),
+                models.Subscription(owner_id=good.id, service_name='monthly', cost=1,
+                                    billing_cycle='monthly', next_billing_date=date(2020, 1, 2)),
+            ]
+            db.add_all(rows)
+            await db.commit()
+            ids = [r.id for r in rows]
+
+        result = await rollover.RolloverJob().run_once(today=date(9995, 1, 1))
+        assert result['skipped_unknown_cycle'] >= 2
+
+        async with SessionLocal() as db:
+            huge, overflow, monthly = [await db.get(models.Subscription, i) for i in ids]
+        assert huge.next_billing_date == date(2020, 1, 1)
+        assert overflow.next_billing_date == date(9990, 1, 1)
+        assert monthly.next_billing_date == date(9995, 1, 2)
+    asyncio.run(main())
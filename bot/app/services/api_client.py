@@ -9,12 +9,42 @@ async def api_login(username, password):
         async with s.post(url, data=data, headers=headers) as resp:
             return resp.status, await resp.json() if resp.content_type == 'application/json' else await resp.text()
 
+# ETag-кэш списков: (url, token) -> (etag, items). При 304 отдаем сохраненный список.
+_LIST_CACHE = {}
+_LIST_CACHE_MAX = 1000
+
+async def _get_all_pages(url: str, headers: dict):
+    """Собирает все страницы списка, следуя за курсором из X-Next-Cursor."""
+    key = (url, headers.get('Authorization'))
+    cached = _LIST_CACHE.get(key)
+    items, params, etag = [], {}, None
+    async with aiohttp.ClientSession() as s:
+        while True:
+            req_headers = headers
+            if not params and cached:
+                req_headers = {**headers, 'If-None-Match': cached[0]}
+            async with s.get(url, headers=req_headers, params=params) as resp:
+                if resp.status == 304 and cached:
+                    return 200, cached[1]
+                if resp.status != 200 or resp.content_type != 'application/json':
+                    return resp.status, await resp.json() if resp.content_type == 'application/json' else await resp.text()
+                if not params:
+                    etag = resp.headers.get('ETag')
+                items.extend(await resp.json())
+                cursor = resp.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+            params = {'cursor': cursor}
+    if etag:
+        if len(_LIST_CACHE) >= _LIST_CACHE_MAX:
+            _LIST_CACHE.clear()
+        _LIST_CACHE[key] = (etag, items)
+    return 200, items
+
 async def api_get_cards(token: str):
     url = f"{API_BASE}/cards"
     headers = {'Authorization': f'Bearer {token}'}
-    async with aiohttp.ClientSession() as s:
-        async with s.get(url, headers=headers) as resp:
-            return resp.status, await resp.json() if resp.content_type == 'application/json' else await resp.text()
+    return await _get_all_pages(url, headers)
 
 async def api_add_card(token: str, payload: dict):
     url = f"{API_BASE}/cards"
@@ -26,9 +56,7 @@ async def api_add_card(token: str, payload: dict):
 async def api_get_subs(token: str):
     url = f"{API_BASE}/subscriptions"
     headers = {'Authorization': f'Bearer {token}'}
-    async with aiohttp.ClientSession() as s:
-        async with s.get(url, headers=headers) as resp:
-            return resp.status, await resp.json() if resp.content_type == 'application/json' else await resp.text()
+    return await _get_all_pages(url, headers)
 
 async def api_add_sub(token: str, payload: dict):
     url = f"{API_BASE}/subscriptions"